@@ -13,17 +13,28 @@ Cost: €2.80 per 1,000 queries on Regolo Core Plan
 """
 
 import os
+import re
 import json
-import pickle
 import time
+import random
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from functools import lru_cache
+from collections import OrderedDict
 from pathlib import Path
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Iterator
 from datetime import datetime
 
 import numpy as np
-from openai import OpenAI
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+import requests
+import scipy.sparse
+import tiktoken
+from openai import OpenAI, AsyncOpenAI
+from sklearn.feature_extraction.text import CountVectorizer, ENGLISH_STOP_WORDS
 import PyPDF2
 
 # Load environment
@@ -43,6 +54,58 @@ CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "600"))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "100"))
 MAX_CHUNKS_RETRIEVE = int(os.getenv("MAX_CHUNKS_RETRIEVE", "20"))
 MAX_CHUNKS_RERANK = int(os.getenv("MAX_CHUNKS_RERANK", "5"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "16"))  # In-flight embedding requests
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "3"))
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "8000"))  # Token budget per embedding batch
+EMBED_STORAGE_DTYPE = os.getenv("EMBED_STORAGE_DTYPE", "int8")  # int8, float16 or float32
+BM25_K1 = float(os.getenv("BM25_K1", "1.5"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+RRF_K = int(os.getenv("RRF_K", "60"))  # Reciprocal Rank Fusion constant
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "100"))  # Per-retriever candidates fused with RRF
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "4096"))  # Cached rerank results (LRU)
+RERANK_CACHE_TTL = int(os.getenv("RERANK_CACHE_TTL", "86400"))   # Seconds
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "10000"))  # Cached query embeddings (LRU)
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.97"))  # Cosine similarity for an answer-cache hit
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "2048"))  # Cached answers (LRU)
+SEMANTIC_CACHE_TTL = int(os.getenv("SEMANTIC_CACHE_TTL", "86400"))   # Seconds
+
+# On-disk index layout: one file per component, so embeddings can be memory-mapped
+INDEX_FILES = {
+    "manifest": "manifest.json",
+    "embeddings": "embeddings.npy",
+    "embedding_scales": "embedding_scales.npy",
+    "bm25_matrix": "bm25_matrix.npz",
+    "bm25_idf": "bm25_idf.npy",
+    "bm25_vocab": "bm25_vocab.json",
+    "chunks": "chunks.json",
+    "metadata": "metadata.json",
+}
+INDEX_MANIFEST_KEYS = ("built_at", "num_docs", "num_chunks", "models")
+
+# Generation instructions: kept byte-identical across queries so the serving side can reuse their KV cache
+ANSWER_SYSTEM_PROMPT = """You are a helpful knowledge base assistant for an enterprise company.
+Your task is to answer questions based ONLY on the provided context.
+
+**Rules:**
+1. Answer concisely and accurately based on the context
+2. If the context doesn't contain enough information, say so clearly
+3. Use bullet points for lists or multiple items
+4. Cite specific sources when making claims
+5. If uncertain, express that uncertainty
+6. Use professional language appropriate for enterprise setting"""
+
+# Most recent query latencies kept for percentile stats
+LATENCY_WINDOW = 4096
+
+# Embedding rows upcast to float32 per block when scoring (bounds the temporary to ~block x dim x 4 bytes)
+DENSE_SCORE_BLOCK = 8192
+
+# CountVectorizer's default token pattern
+BM25_TOKEN_RE = re.compile(r"(?u)\b\w\w+\b")
+
+# Sentence boundary: terminal punctuation followed by whitespace and an uppercase
+# letter (avoids splitting decimals like "3.5"), or the start of a paragraph
+SENT_RE = re.compile(r"(?<=[.!?])\s+(?=[A-Z])|\s+(?=¶)")
 
 # Initialize Regolo client (OpenAI-compatible)
 client = OpenAI(
@@ -50,6 +113,13 @@ client = OpenAI(
     base_url=REGOLO_BASE_URL
 )
 
+# Shared HTTP session for the rerank endpoint (keeps the TCP/TLS connection alive)
+http_session = requests.Session()
+http_session.headers.update({
+    "Authorization": f"Bearer {REGOLO_API_KEY}",
+    "Content-Type": "application/json"
+})
+
 # Pricing (€ per 1M tokens, as of Jan 2026)
 # Source: https://regolo.ai/pricing
 PRICING = {
@@ -61,6 +131,301 @@ PRICING = {
     "Qwen2.5-72B-Instruct": {"input": 0.50, "output": 1.80},
 }
 
+# Prices for the configured models, resolved once at import
+EMBED_PRICE_INPUT = PRICING.get(EMBED_MODEL, {}).get("input", 0.05)
+RERANK_PRICE_PER_QUERY = PRICING.get(RERANK_MODEL, {}).get("per_query", 0.01)
+CHAT_PRICE_INPUT = PRICING.get(CHAT_MODEL, {}).get("input", 0.05)
+CHAT_PRICE_OUTPUT = PRICING.get(CHAT_MODEL, {}).get("output", 0.25)
+
+
+@lru_cache(maxsize=1)
+def _tokenizer() -> tiktoken.Encoding:
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """
+    Token count per text (batch encode runs on native threads, outside the GIL).
+    Special-token strings like <|endoftext|> are counted as plain text instead of raising.
+    """
+    return [len(tokens) for tokens in _tokenizer().encode_batch(texts, num_threads=8, disallowed_special=())]
+
+
+def _run_sync(coro):
+    """Run a coroutine to completion, even when called from inside a running event loop."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return asyncio.run(coro)
+    # Already inside a loop (e.g. a Telegram handler): run on a helper thread
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        return executor.submit(asyncio.run, coro).result()
+
+
+def quantize_int8(x: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric absmax int8 quantization with one scale per row."""
+    x = np.atleast_2d(x)
+    scales = np.maximum(np.abs(x).max(axis=1), 1e-12) / 127
+    q = np.round(x / scales[:, None]).astype(np.int8)
+    return q, scales.astype(np.float32)
+
+
+def bm25_analyze(text: str) -> List[str]:
+    """
+    Lowercased unigrams + bigrams with English stop words removed.
+    Used as the CountVectorizer analyzer at build time and for query lookup,
+    so only the vocabulary needs to be stored with the index.
+    """
+    words = [w for w in BM25_TOKEN_RE.findall(text.lower()) if w not in ENGLISH_STOP_WORDS]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def bm25_weights(counts, k1: float = BM25_K1, b: float = BM25_B):
+    """
+    Precompute the BM25 weight of every (chunk, term) pair from raw term counts.
+    Scoring a query then reduces to summing the matrix columns of its terms.
+    Returns: (weights as CSC matrix, idf array)
+    """
+    counts = counts.tocsr().astype(np.float32, copy=False)
+    n_docs = counts.shape[0]
+    doc_len = np.asarray(counts.sum(axis=1)).ravel()
+    avg_len = max(doc_len.mean(), 1e-12) if n_docs else 1.0
+    
+    df = np.bincount(counts.indices, minlength=counts.shape[1])
+    idf = np.log1p((n_docs - df + 0.5) / (df + 0.5)).astype(np.float32)
+    
+    tf = counts.data
+    row_len = np.repeat(doc_len, np.diff(counts.indptr))
+    weights = counts.copy()
+    weights.data = (idf[counts.indices] * tf * (k1 + 1) / (tf + k1 * (1 - b + b * row_len / avg_len))).astype(np.float32)
+    # CSC: a query reads whole columns (one posting list per term)
+    weights = weights.tocsc()
+    weights.sort_indices()
+    return weights, idf
+
+
+def _extract_pdf_text(filepath: Path) -> str:
+    """Extract text from PDF file."""
+    text = ""
+    try:
+        with open(filepath, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            for page in reader.pages:
+                text += page.extract_text() + "\n"
+    except Exception as e:
+        print(f"⚠️  PDF extraction error for {filepath.name}: {e}")
+    return text
+
+
+def _extract_file(filepath: Path) -> Tuple[str, Optional[str]]:
+    """
+    Read one document. Module-level so it can run in a worker process.
+    Returns: (content, error message or None)
+    """
+    try:
+        if filepath.suffix == ".pdf":
+            return _extract_pdf_text(filepath), None
+        return filepath.read_text(encoding="utf-8", errors='ignore'), None
+    except Exception as e:
+        return "", str(e)
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first (O(N) selection + O(k log k) sort)."""
+    n = len(scores)
+    if k >= n:
+        return np.argsort(scores)[::-1]
+    # Select the top k in place of negating (which would copy all N scores)
+    idx = np.argpartition(scores, n - k)[n - k:]
+    return idx[np.argsort(scores[idx])[::-1]]
+
+
+class EmbeddingCache:
+    """
+    Persistent embedding cache backed by SQLite.
+    Keys hash the chunk text together with EMBED_MODEL, so switching models
+    invalidates old entries automatically.
+    One instance can be shared across threads: the connection is serialized by a lock.
+    """
+    
+    def __init__(self, path: str):
+        Path(path).parent.mkdir(exist_ok=True, parents=True)
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings (key BLOB PRIMARY KEY, vector BLOB NOT NULL)"
+        )
+    
+    @staticmethod
+    def key(text: str) -> bytes:
+        return hashlib.blake2b(
+            EMBED_MODEL.encode("utf-8") + b"\x00" + text.encode("utf-8"),
+            digest_size=16
+        ).digest()
+    
+    def get_many(self, keys: List[bytes]) -> Dict[bytes, np.ndarray]:
+        """Return {key: embedding} for every key present in the cache."""
+        found = {}
+        unique = list(set(keys))
+        with self.lock:
+            for i in range(0, len(unique), 500):  # Stay under SQLite's bound-parameter limit
+                part = unique[i:i+500]
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(part))})",
+                    part
+                )
+                for key, vector in rows:
+                    found[key] = np.frombuffer(vector, dtype=np.float32)
+        return found
+    
+    def put_many(self, items: List[Tuple[bytes, np.ndarray]]) -> None:
+        rows = [(key, np.asarray(emb, dtype=np.float32).tobytes()) for key, emb in items]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                rows
+            )
+            self.conn.commit()
+    
+    def close(self) -> None:
+        with self.lock:
+            self.conn.close()
+
+
+class LSHIndex:
+    """
+    Random-hyperplane LSH for cosine similarity.
+    Each of L tables hashes a vector to the sign pattern of K random projections;
+    near-duplicate vectors share a bucket in at least one table with high probability.
+    """
+    
+    def __init__(self, d: int, K: int = 16, L: int = 8, seed: int = 0):
+        rng = np.random.default_rng(seed)
+        self.planes = rng.standard_normal((L, K, d)).astype(np.float32)
+        self.tables: List[Dict[bytes, set]] = [{} for _ in range(L)]
+    
+    def hash(self, v: np.ndarray) -> List[bytes]:
+        """One K-bit bucket key per table."""
+        bits = (self.planes @ v) > 0  # (L, K)
+        return [row.tobytes() for row in np.packbits(bits, axis=1)]
+    
+    def insert(self, item_id: int, v: np.ndarray) -> List[bytes]:
+        hashes = self.hash(v)
+        for table, h in zip(self.tables, hashes):
+            table.setdefault(h, set()).add(item_id)
+        return hashes
+    
+    def remove(self, item_id: int, hashes: List[bytes]) -> None:
+        for table, h in zip(self.tables, hashes):
+            bucket = table.get(h)
+            if bucket is not None:
+                bucket.discard(item_id)
+                if not bucket:
+                    del table[h]
+    
+    def query(self, v: np.ndarray) -> set:
+        """Ids sharing a bucket with v in any table."""
+        found = set()
+        for table, h in zip(self.tables, self.hash(v)):
+            found |= table.get(h, set())
+        return found
+
+
+class SemanticQueryCache:
+    """
+    Answer cache in front of KnowledgeBaseRAG.query.
+    A question whose embedding is within SEMANTIC_CACHE_THRESHOLD cosine similarity
+    of a cached one reuses that answer, skipping rerank and generation.
+    Lookups probe an LSH index and compare exactly only against the colliding entries.
+    Entries are bound to the index build (built_at) they were answered from.
+    """
+    
+    def __init__(self, rag: "KnowledgeBaseRAG", threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 ttl: int = SEMANTIC_CACHE_TTL, max_entries: int = SEMANTIC_CACHE_SIZE):
+        self.rag = rag
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.clear()
+    
+    def clear(self) -> None:
+        """Drop every cached answer (call after rebuilding the index)."""
+        with self.lock:
+            self.lsh = None  # Built on first insert, once the embedding size is known
+            # id -> {emb, hashes, result, built_at, stored_at}, in LRU order
+            self.entries: OrderedDict = OrderedDict()
+            self._next_id = 0
+    
+    def get(self, question: str) -> Optional[Dict]:
+        """Return a cached result for a near-duplicate question, or None."""
+        t0 = time.time()
+        if not self.rag.index:
+            return None
+        q = self.rag._embed_one(question)
+        if not q.any():
+            return None
+        
+        with self.lock:
+            if self.lsh is None:
+                return None
+            ids = list(self.lsh.query(q))
+            if not ids:
+                return None
+            # Embeddings are unit-norm: one dot product per candidate is the cosine
+            sims = np.stack([self.entries[j]["emb"] for j in ids]) @ q
+            best = int(np.argmax(sims))
+            if sims[best] < self.threshold:
+                return None
+            
+            item_id = ids[best]
+            entry = self.entries[item_id]
+            if entry["built_at"] != self.rag.index["built_at"] or t0 - entry["stored_at"] > self.ttl:
+                self._remove(item_id)
+                return None
+            self.entries.move_to_end(item_id)
+        
+        result = dict(entry["result"])
+        result["cost_eur"] = 0.0
+        result["total_latency_ms"] = (time.time() - t0) * 1000
+        result["cache_similarity"] = float(sims[best])
+        return result
+    
+    def put(self, question: str, result: Dict) -> None:
+        """Cache result for question; failed generations are never stored."""
+        if not self.rag.index or result.get("error"):
+            return
+        q = self.rag._embed_one(question)  # Served from the query-embedding LRU
+        if not q.any():
+            return
+        
+        with self.lock:
+            if self.lsh is None:
+                self.lsh = LSHIndex(len(q))
+            item_id = self._next_id
+            self._next_id += 1
+            self.entries[item_id] = {
+                "emb": q,
+                "hashes": self.lsh.insert(item_id, q),
+                "result": result,
+                "built_at": self.rag.index["built_at"],
+                "stored_at": time.time()
+            }
+            if len(self.entries) > self.max_entries:
+                self._remove(next(iter(self.entries)))
+    
+    def get_or_compute(self, question: str, compute) -> Dict:
+        """Cached result for `question`, else compute(question) and cache it."""
+        result = self.get(question)
+        if result is None:
+            result = compute(question)
+            self.put(question, result)
+        return result
+    
+    def _remove(self, item_id: int) -> None:
+        entry = self.entries.pop(item_id)
+        self.lsh.remove(item_id, entry["hashes"])
+
 
 class KnowledgeBaseRAG:
     """Production RAG pipeline using Regolo GPU infrastructure."""
@@ -71,53 +436,66 @@ class KnowledgeBaseRAG:
         self.metrics = {
             "queries_total": 0,
             "cost_total_eur": 0.0,
-            "latency_history": [],
             "embedding_tokens": 0,
             "generation_input_tokens": 0,
             "generation_output_tokens": 0,
             "rerank_queries": 0
         }
+        # Ring buffer of the last LATENCY_WINDOW generation latencies (ms)
+        self._latencies = np.empty(LATENCY_WINDOW, dtype=np.float32)
+        self._latency_count = 0
+        self._latency_pos = 0
+        self._latency_lock = threading.Lock()  # Queries record latencies from several worker threads
+        # (query, candidate ids) -> (stored_at, reranked results), in LRU order
+        self._rerank_cache: OrderedDict = OrderedDict()
+        self._rerank_cache_lock = threading.Lock()
+        # Normalized query text -> L2-normalized float32 embedding, in LRU order
+        self._query_emb_cache: OrderedDict = OrderedDict()
+        self._query_emb_cache_lock = threading.Lock()
+        # On-disk embedding cache, opened on first use and shared by every thread
+        self._embed_cache: Optional[EmbeddingCache] = None
     
     def load_documents(self, docs_path: str = KB_DOCS_PATH) -> List[Dict]:
-        """Load all text, markdown, and PDF documents."""
+        """Load all text, markdown, and PDF documents (extracted in parallel across cores)."""
         docs = []
         print(f"📚 Loading documents from {docs_path}")
         
-        for ext in ["*.txt", "*.md", "*.pdf"]:
-            for filepath in Path(docs_path).rglob(ext):
-                try:
-                    if filepath.suffix == ".pdf":
-                        content = self._extract_pdf_text(filepath)
-                    else:
-                        content = filepath.read_text(encoding="utf-8", errors='ignore')
-                    
-                    if len(content.strip()) < 50:  # Skip empty/tiny files
-                        continue
-                    
-                    docs.append({
-                        "content": content,
-                        "source": str(filepath.relative_to(docs_path)),
-                        "id": f"doc_{len(docs)}",
-                        "modified": datetime.fromtimestamp(filepath.stat().st_mtime)
-                    })
-                except Exception as e:
-                    print(f"⚠️  Skipped {filepath.name}: {e}")
+        filepaths = [
+            filepath
+            for ext in ["*.txt", "*.md", "*.pdf"]
+            for filepath in Path(docs_path).rglob(ext)
+        ]
+        
+        if len(filepaths) <= 1:
+            results = [_extract_file(filepath) for filepath in filepaths]
+        else:
+            # Never fork: the bot calls this from a worker thread of a multi-threaded process
+            # (event loop, HTTP pools, SQLite), and a forked child can inherit a held lock
+            start_method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            with ProcessPoolExecutor(
+                max_workers=min(os.cpu_count() or 1, len(filepaths)),
+                mp_context=multiprocessing.get_context(start_method)
+            ) as executor:
+                results = list(executor.map(_extract_file, filepaths, chunksize=8))
+        
+        for filepath, (content, error) in zip(filepaths, results):
+            if error:
+                print(f"⚠️  Skipped {filepath.name}: {error}")
+                continue
+            
+            if len(content.strip()) < 50:  # Skip empty/tiny files
+                continue
+            
+            docs.append({
+                "content": content,
+                "source": str(filepath.relative_to(docs_path)),
+                "id": f"doc_{len(docs)}",
+                "mtime": filepath.stat().st_mtime  # Raw float; format with datetime.fromtimestamp() for display
+            })
         
         print(f"✅ Loaded {len(docs)} documents")
         return docs
     
-    def _extract_pdf_text(self, filepath: Path) -> str:
-        """Extract text from PDF file."""
-        text = ""
-        try:
-            with open(filepath, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                for page in reader.pages:
-                    text += page.extract_text() + "\n"
-        except Exception as e:
-            print(f"⚠️  PDF extraction error for {filepath.name}: {e}")
-        return text
-    
     def semantic_chunk(self, text: str) -> List[str]:
         """
         Split text into semantic chunks with overlap.
@@ -126,43 +504,42 @@ class KnowledgeBaseRAG:
         # Clean text
         text = text.replace("\n\n", " ¶ ").replace("\n", " ")
         
-        # Split by sentences (simple heuristic)
-        sentences = []
-        for part in text.split(". "):
-            if part.strip():
-                sentences.append(part.strip() + ".")
+        # Split by sentences
+        sentences = [part.strip() for part in SENT_RE.split(text) if part.strip()]
         
-        # Build chunks
+        # Build chunks from sentence lists; strings are joined only when a chunk is flushed
         chunks = []
-        current_chunk = ""
+        parts: List[str] = []
+        parts_len = 0
         
         for sentence in sentences:
-            if len(current_chunk) + len(sentence) < CHUNK_SIZE:
-                current_chunk += " " + sentence
-            else:
-                if current_chunk.strip():
-                    chunks.append(current_chunk.strip())
-                current_chunk = sentence
-        
-        if current_chunk.strip():
-            chunks.append(current_chunk.strip())
+            if parts and parts_len + len(sentence) >= CHUNK_SIZE:
+                chunks.append(" ".join(parts))
+                
+                # Overlap: carry over the trailing sentences that fit in CHUNK_OVERLAP chars
+                overlap: List[str] = []
+                overlap_len = 0
+                for prev in reversed(parts):
+                    if overlap_len + len(prev) > CHUNK_OVERLAP:
+                        break
+                    overlap.append(prev)
+                    overlap_len += len(prev) + 1
+                parts = overlap[::-1]
+                parts_len = overlap_len
+            
+            parts.append(sentence)
+            parts_len += len(sentence) + 1
         
-        # Add overlap between chunks
-        overlapped = []
-        for i, chunk in enumerate(chunks):
-            if i > 0 and CHUNK_OVERLAP > 0:
-                # Take last N chars from previous chunk
-                prev_overlap = chunks[i-1][-CHUNK_OVERLAP:]
-                chunk = prev_overlap + " " + chunk
-            overlapped.append(chunk)
+        if parts:
+            chunks.append(" ".join(parts))
         
-        return overlapped
+        return chunks
     
     def build_index(self, docs: List[Dict]) -> Dict:
         """
         Build hybrid index:
         1. Dense embeddings (gte-Qwen2 via Regolo)
-        2. Lexical index (TF-IDF for BM25-style retrieval)
+        2. Lexical index (BM25)
         """
         print("🔪 Chunking documents...")
         chunks = []
@@ -176,28 +553,45 @@ class KnowledgeBaseRAG:
                     "source": doc["source"],
                     "chunk_id": i,
                     "doc_id": doc["id"],
-                    "modified": doc["modified"].isoformat()
+                    "mtime": doc["mtime"]
                 })
         
+        # Count tokens once; reused for batching, metrics and cost
+        for meta, n_tokens in zip(metadata, count_tokens(chunks)):
+            meta["n_tokens"] = n_tokens
+        
         print(f"✅ Created {len(chunks)} chunks from {len(docs)} documents")
         
         # Generate embeddings via Regolo GPU
         print(f"🔢 Generating embeddings via Regolo GPU ({EMBED_MODEL})...")
-        embeddings = self._batch_embed(chunks)
+        embeddings = self._embed_with_cache(chunks, [m["n_tokens"] for m in metadata])
+        
+        # L2-normalize once so query-time cosine similarity is a plain dot product
+        embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        embeddings = np.ascontiguousarray(embeddings, dtype=np.float32)
+        
+        # Quantize for storage: int8 is 4x smaller than float32, float16 is 2x
+        embedding_scales = None
+        if EMBED_STORAGE_DTYPE == "int8":
+            embeddings, embedding_scales = quantize_int8(embeddings)
+        elif EMBED_STORAGE_DTYPE == "float16":
+            embeddings = embeddings.astype(np.float16)
         
         # Build lexical index
-        print("📖 Building lexical index (TF-IDF for BM25)...")
-        tfidf = TfidfVectorizer(max_features=5000, ngram_range=(1, 2), stop_words='english')
-        tfidf_matrix = tfidf.fit_transform(chunks)
+        print("📖 Building lexical index (BM25)...")
+        bm25_vectorizer = CountVectorizer(analyzer=bm25_analyze, dtype=np.float32)
+        bm25_matrix, bm25_idf = bm25_weights(bm25_vectorizer.fit_transform(chunks))
+        bm25_vocab = {term: int(i) for term, i in bm25_vectorizer.vocabulary_.items()}
         
         # Save index
-        Path(self.index_path).mkdir(exist_ok=True, parents=True)
         index = {
             "chunks": chunks,
             "metadata": metadata,
             "embeddings": embeddings,
-            "tfidf_vectorizer": tfidf,
-            "tfidf_matrix": tfidf_matrix,
+            "embedding_scales": embedding_scales,
+            "bm25_vocab": bm25_vocab,
+            "bm25_matrix": bm25_matrix,
+            "bm25_idf": bm25_idf,
             "built_at": datetime.now().isoformat(),
             "num_docs": len(docs),
             "num_chunks": len(chunks),
@@ -208,64 +602,297 @@ class KnowledgeBaseRAG:
             }
         }
         
-        index_file = f"{self.index_path}/kb-index.pkl"
-        with open(index_file, "wb") as f:
-            pickle.dump(index, f)
+        self._save_index(index)
         
         # Calculate cost
-        total_tokens = sum(len(c.split()) * 1.3 for c in chunks)  # ~1.3 tokens per word
-        cost = (total_tokens / 1_000_000) * PRICING.get(EMBED_MODEL, {}).get("input", 0.05)
+        total_tokens = sum(m["n_tokens"] for m in metadata)
+        cost = (total_tokens / 1_000_000) * EMBED_PRICE_INPUT
         
-        file_size = Path(index_file).stat().st_size / 1024 / 1024
-        print(f"💾 Index saved to {index_file}")
+        file_size = sum(
+            (Path(self.index_path) / name).stat().st_size for name in INDEX_FILES.values()
+            if (Path(self.index_path) / name).exists()
+        ) / 1024 / 1024
+        print(f"💾 Index saved to {self.index_path}/")
         print(f"├─ Size: {file_size:.1f} MB")
         print(f"└─ Embedding cost: €{cost:.4f}")
         
         return index
     
-    def _batch_embed(self, texts: List[str], batch_size: int = 50) -> np.ndarray:
-        """Generate embeddings in batches via Regolo API."""
-        embeddings = []
-        total_batches = (len(texts) + batch_size - 1) // batch_size
+    def _get_embed_cache(self) -> EmbeddingCache:
+        """The on-disk embedding cache: one connection per pipeline instead of one per call."""
+        with self._query_emb_cache_lock:
+            if self._embed_cache is None:
+                self._embed_cache = EmbeddingCache(f"{self.index_path}/embed-cache.sqlite3")
+            return self._embed_cache
+    
+    def close_embed_cache(self) -> None:
+        """Close the embedding cache connection (reopened on next use), e.g. after an index rebuild."""
+        with self._query_emb_cache_lock:
+            cache, self._embed_cache = self._embed_cache, None
+        if cache is not None:
+            cache.close()
+    
+    def _embed_with_cache(self, texts: List[str], token_counts: List[int]) -> np.ndarray:
+        """Embed texts, reusing cached embeddings and only sending cache misses to the API."""
+        cache = self._get_embed_cache()
+        keys = [cache.key(t) for t in texts]
+        cached = cache.get_many(keys)
+        misses = [i for i, key in enumerate(keys) if key not in cached]
+        print(f"  ├─ Cache: {len(texts) - len(misses)} hits, {len(misses)} to embed")
         
-        for i in range(0, len(texts), batch_size):
-            batch = texts[i:i+batch_size]
-            batch_num = i // batch_size + 1
-            
+        fresh = None
+        if misses:
+            fresh = self._batch_embed(
+                [texts[i] for i in misses],
+                token_counts=[token_counts[i] for i in misses]
+            )
+        
+        # Assemble into one preallocated matrix
+        if fresh is not None:
+            dim = fresh.shape[1]
+        elif cached:
+            dim = len(next(iter(cached.values())))
+        else:
+            dim = 768
+        embeddings = np.empty((len(texts), dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key in cached:
+                embeddings[i] = cached[key]
+        if misses:
+            embeddings[misses] = fresh
+            # Don't cache zero-vector fallbacks from failed batches
+            cache.put_many([(keys[i], embeddings[i]) for i in misses if embeddings[i].any()])
+        
+        return embeddings
+    
+    def _embed_one(self, text: str) -> np.ndarray:
+        """
+        Embed a single query, L2-normalized. Repeat queries (after whitespace and
+        case normalization) are served from an in-memory LRU without an API call;
+        below that, the on-disk embedding cache survives restarts.
+        """
+        key = " ".join(text.lower().split())
+        with self._query_emb_cache_lock:
+            cached = self._query_emb_cache.get(key)
+            if cached is not None:
+                self._query_emb_cache.move_to_end(key)
+                return cached
+        
+        cache = self._get_embed_cache()
+        disk_key = cache.key(text)
+        stored = cache.get_many([disk_key]).get(disk_key)
+        if stored is not None:
+            emb = stored.copy()
+        else:
+            emb = self._batch_embed([text])[0]
+            if emb.any():
+                cache.put_many([(disk_key, emb)])
+        
+        emb /= max(np.linalg.norm(emb), 1e-12)
+        if not emb.any():  # Failed request: zero-vector fallback, don't cache
+            return emb
+        
+        emb.flags.writeable = False  # Shared between callers
+        with self._query_emb_cache_lock:
+            self._query_emb_cache[key] = emb
+            if len(self._query_emb_cache) > QUERY_EMBED_CACHE_SIZE:
+                self._query_emb_cache.popitem(last=False)
+        return emb
+    
+    def _batch_embed(self, texts: List[str], batch_size: int = 50,
+                     token_counts: Optional[List[int]] = None) -> np.ndarray:
+        """Generate embeddings in batches via Regolo API."""
+        if len(texts) == 1 and token_counts is None:
+            # A single query needs no length-sorted batching: skip tokenizing (and its thread pool)
+            return self._embed_sync(texts)
+        if token_counts is None:
+            token_counts = count_tokens(texts)
+        batches = self._length_sorted_batches(token_counts, batch_size)
+        if len(batches) <= 1:
+            # One request (e.g. a query): the pooled sync client, no event loop or new connection
+            return self._embed_sync(texts, token_counts)
+        return _run_sync(self._abatch_embed(texts, token_counts, batches))
+    
+    def _embed_sync(self, texts: List[str], token_counts: Optional[List[int]] = None) -> np.ndarray:
+        """
+        Embed texts in a single request on the module-level client, retrying like _embed_batch.
+        Falls back to zero vectors if every attempt fails. Without token_counts, the
+        token metric comes from the response's usage field.
+        """
+        for attempt in range(EMBED_MAX_RETRIES + 1):
             t0 = time.time()
             try:
                 response = client.embeddings.create(
                     model=EMBED_MODEL,
-                    input=batch
+                    input=texts
                 )
-                latency = (time.time() - t0) * 1000
-                
-                batch_embs = [np.array(d.embedding, dtype=np.float32) for d in response.data]
-                embeddings.extend(batch_embs)
-                
-                # Track tokens
-                self.metrics["embedding_tokens"] += sum(len(t.split()) * 1.3 for t in batch)
-                
-                print(f"  ├─ Batch {batch_num}/{total_batches}: {len(embeddings)} chunks embedded ({latency:.0f}ms)")
-            
             except Exception as e:
-                print(f"  ❌ Batch {batch_num} failed: {e}")
-                # Use zero vectors as fallback
-                embeddings.extend([np.zeros(768, dtype=np.float32) for _ in batch])
+                if attempt == EMBED_MAX_RETRIES:
+                    print(f"  ❌ Embedding request failed: {e}")
+                    break
+                time.sleep((2 ** attempt) * 0.5 + random.uniform(0, 0.5))
+                continue
+            
+            latency = (time.time() - t0) * 1000
+            if token_counts is not None:
+                self.metrics["embedding_tokens"] += sum(token_counts)
+            elif response.usage:
+                self.metrics["embedding_tokens"] += response.usage.prompt_tokens
+            if len(texts) > 1:
+                print(f"  ├─ Batch 1/1: {len(texts)} chunks embedded ({latency:.0f}ms)")
+            return np.asarray([d.embedding for d in response.data], dtype=np.float32)
         
-        return np.array(embeddings, dtype=np.float32)
+        return np.zeros((len(texts), 768), dtype=np.float32)
+    
+    async def _abatch_embed(self, texts: List[str], token_counts: List[int], batches: List[List[int]]) -> np.ndarray:
+        """
+        Embed all batches concurrently (at most EMBED_CONCURRENCY in flight).
+        Results are written back by position, so output order matches input order.
+        """
+        semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+        # The output matrix is allocated once, when the first batch reveals the dimension
+        state = {"done": 0, "total": len(texts), "embeddings": None}
+        
+        async with AsyncOpenAI(api_key=REGOLO_API_KEY, base_url=REGOLO_BASE_URL) as aclient:
+            await asyncio.gather(*(
+                self._embed_batch(aclient, semaphore, texts, token_counts, indices, batch_num, len(batches), state)
+                for batch_num, indices in enumerate(batches, 1)
+            ))
+        
+        if state["embeddings"] is None:  # Every batch failed
+            return np.zeros((len(texts), 768), dtype=np.float32)
+        return state["embeddings"]
+    
+    @staticmethod
+    def _length_sorted_batches(token_counts: List[int], batch_size: int) -> List[List[int]]:
+        """
+        Group text indices into batches of similar token length.
+        The server pads every batch to its longest input, so sorting by length
+        avoids mixing short and long chunks. A batch is closed when it reaches
+        batch_size items or EMBED_BATCH_TOKENS tokens, which keeps
+        batches of long chunks small.
+        """
+        order = sorted(range(len(token_counts)), key=token_counts.__getitem__)
+        batches = []
+        current, current_tokens = [], 0
+        
+        for i in order:
+            tokens = token_counts[i]
+            if current and (len(current) >= batch_size or current_tokens + tokens > EMBED_BATCH_TOKENS):
+                batches.append(current)
+                current, current_tokens = [], 0
+            current.append(i)
+            current_tokens += tokens
+        
+        if current:
+            batches.append(current)
+        return batches
+    
+    async def _embed_batch(self, aclient: AsyncOpenAI, semaphore: asyncio.Semaphore,
+                           texts: List[str], token_counts: List[int], indices: List[int],
+                           batch_num: int, total_batches: int, state: Dict) -> None:
+        """
+        Embed the texts at `indices`, retrying with jittered exponential backoff.
+        Rows of batches that still fail stay as zero vectors (fallback).
+        """
+        batch = [texts[i] for i in indices]
+        
+        async with semaphore:
+            for attempt in range(EMBED_MAX_RETRIES + 1):
+                t0 = time.time()
+                try:
+                    response = await aclient.embeddings.create(
+                        model=EMBED_MODEL,
+                        input=batch
+                    )
+                    latency = (time.time() - t0) * 1000
+                    
+                    batch_embs = np.asarray([d.embedding for d in response.data], dtype=np.float32)
+                    if state["embeddings"] is None:
+                        state["embeddings"] = np.zeros((state["total"], batch_embs.shape[1]), dtype=np.float32)
+                    
+                    # Scatter back to original positions
+                    state["embeddings"][indices] = batch_embs
+                    
+                    # Track tokens
+                    self.metrics["embedding_tokens"] += sum(token_counts[i] for i in indices)
+                    
+                    state["done"] += len(batch)
+                    print(f"  ├─ Batch {batch_num}/{total_batches}: {state['done']} chunks embedded ({latency:.0f}ms)")
+                    return
+                
+                except Exception as e:
+                    if attempt == EMBED_MAX_RETRIES:
+                        print(f"  ❌ Batch {batch_num} failed: {e}")
+                        break
+                    # Back off with jitter so throttled batches don't retry in lockstep
+                    await asyncio.sleep((2 ** attempt) * 0.5 + random.uniform(0, 0.5))
+    
+    def _save_index(self, index: Dict) -> None:
+        """
+        Write each index component to its own file (see INDEX_FILES).
+        Every file is staged under a .tmp name, then moved into place with os.replace,
+        manifest last. A readable manifest therefore means a complete index, and a
+        process that still has the old embeddings memory-mapped keeps a valid view
+        (the old file is unlinked, never truncated in place).
+        """
+        index_dir = Path(self.index_path)
+        index_dir.mkdir(exist_ok=True, parents=True)
+        staged = []
+        
+        def stage(name, write):
+            final = index_dir / INDEX_FILES[name]
+            tmp = final.with_name(final.name + ".tmp")
+            with open(tmp, "wb") as f:  # File objects: numpy/scipy don't append extensions
+                write(f)
+            staged.append((tmp, final))
+        
+        def dump_json(obj, **kwargs):
+            return lambda f: f.write(json.dumps(obj, ensure_ascii=False, **kwargs).encode("utf-8"))
+        
+        stage("embeddings", lambda f: np.save(f, index["embeddings"]))
+        if index["embedding_scales"] is not None:
+            stage("embedding_scales", lambda f: np.save(f, index["embedding_scales"]))
+        # Uncompressed: loading skips zlib inflation of the posting lists
+        stage("bm25_matrix", lambda f: scipy.sparse.save_npz(f, index["bm25_matrix"], compressed=False))
+        stage("bm25_idf", lambda f: np.save(f, index["bm25_idf"]))
+        stage("bm25_vocab", dump_json(index["bm25_vocab"]))
+        stage("chunks", dump_json(index["chunks"]))
+        stage("metadata", dump_json(index["metadata"]))
+        stage("manifest", dump_json({key: index[key] for key in INDEX_MANIFEST_KEYS}, indent=2))
+        
+        for tmp, final in staged:
+            os.replace(tmp, final)
+        if index["embedding_scales"] is None:
+            # Stale scales from an earlier int8 build would be picked up by load_index
+            (index_dir / INDEX_FILES["embedding_scales"]).unlink(missing_ok=True)
     
     def load_index(self) -> bool:
-        """Load pre-built index from disk."""
-        index_file = f"{self.index_path}/kb-index.pkl"
-        if not Path(index_file).exists():
-            print(f"❌ Index not found at {index_file}")
+        """Load pre-built index from disk (embeddings are memory-mapped, not read into RAM)."""
+        index_dir = Path(self.index_path)
+        manifest_file = index_dir / INDEX_FILES["manifest"]
+        if not manifest_file.exists():
+            print(f"❌ Index not found at {manifest_file}")
             print("Run: python3 -c \"from rag_pipeline import build_knowledge_base; build_knowledge_base()\"")
             return False
         
-        with open(index_file, "rb") as f:
-            self.index = pickle.load(f)
+        with open(manifest_file, encoding="utf-8") as f:
+            index = json.load(f)
+        
+        index["embeddings"] = np.load(index_dir / INDEX_FILES["embeddings"], mmap_mode="r")
+        scales_file = index_dir / INDEX_FILES["embedding_scales"]
+        index["embedding_scales"] = np.load(scales_file) if scales_file.exists() else None
+        index["bm25_matrix"] = scipy.sparse.load_npz(index_dir / INDEX_FILES["bm25_matrix"]).tocsc().astype(np.float32, copy=False)
+        index["bm25_idf"] = np.load(index_dir / INDEX_FILES["bm25_idf"])
+        with open(index_dir / INDEX_FILES["bm25_vocab"], encoding="utf-8") as f:
+            index["bm25_vocab"] = json.load(f)
+        
+        with open(index_dir / INDEX_FILES["chunks"], encoding="utf-8") as f:
+            index["chunks"] = json.load(f)
+        with open(index_dir / INDEX_FILES["metadata"], encoding="utf-8") as f:
+            index["metadata"] = json.load(f)
         
+        self.index = index  # One reference swap: in-flight queries finish on the previous index
         print(f"✅ Index loaded: {self.index['num_docs']} docs, {self.index['num_chunks']} chunks")
         return True
     
@@ -277,37 +904,73 @@ class KnowledgeBaseRAG:
         if not self.index:
             raise ValueError("Index not loaded. Call load_index() first.")
         
-        # Dense retrieval (cosine similarity on embeddings)
-        query_emb = self._batch_embed([query])[0]
-        dense_scores = cosine_similarity(
-            query_emb.reshape(1, -1),
-            self.index["embeddings"]
-        )[0]
+        # Dense retrieval (cosine similarity = dot product on normalized embeddings)
+        query_emb = self._embed_one(query)
+        dense_scores = self._dense_scores(query_emb)
         
-        # Lexical retrieval (TF-IDF)
-        query_tfidf = self.index["tfidf_vectorizer"].transform([query])
-        lexical_scores = cosine_similarity(
-            query_tfidf,
-            self.index["tfidf_matrix"]
-        )[0]
+        # Lexical retrieval (BM25): walk the posting lists of the query's terms,
+        # so only chunks containing at least one query term are scored
+        vocab = self.index["bm25_vocab"]
+        term_ids = sorted({vocab[t] for t in bm25_analyze(query) if t in vocab})
+        postings = self.index["bm25_matrix"][:, term_ids]
+        lexical_ids, inverse = np.unique(postings.indices, return_inverse=True)
+        lexical_scores = np.bincount(inverse, weights=postings.data).astype(np.float32)
         
-        # Fusion: weighted average (60% dense, 40% lexical)
-        # Adjust weights based on your use case
-        fused_scores = 0.6 * dense_scores + 0.4 * lexical_scores
+        # Candidates: union of the top HYBRID_CANDIDATES from each retriever
+        num_candidates = max(k, HYBRID_CANDIDATES)
+        dense_top = top_k_indices(dense_scores, num_candidates)
+        lexical_top = lexical_ids[top_k_indices(lexical_scores, num_candidates)]
+        candidates = np.union1d(dense_top, lexical_top)
+        
+        # Fusion: Reciprocal Rank Fusion (scale-free, unlike averaging cosine and BM25 scores)
+        fused_scores = np.zeros(len(candidates), dtype=np.float32)
+        fused_scores[np.searchsorted(candidates, dense_top)] += 1.0 / (RRF_K + np.arange(1, len(dense_top) + 1))
+        fused_scores[np.searchsorted(candidates, lexical_top)] += 1.0 / (RRF_K + np.arange(1, len(lexical_top) + 1))
         
         # Top-k
-        top_indices = np.argsort(fused_scores)[-k:][::-1]
+        top = top_k_indices(fused_scores, k)
         
         results = []
-        for idx in top_indices:
+        for pos in top:
+            idx = candidates[pos]
             results.append((
                 self.index["chunks"][idx],
                 self.index["metadata"][idx],
-                float(fused_scores[idx])
+                float(fused_scores[pos])
             ))
         
         return results
     
+    def _dense_scores(self, query_emb: np.ndarray) -> np.ndarray:
+        """
+        Dot product of a normalized query against the (possibly quantized) embedding matrix.
+        int8/float16 rows are upcast to float32 one block at a time so the product runs
+        through BLAS without materializing a full-precision copy of the index.
+        """
+        embeddings = self.index["embeddings"]
+        q = np.asarray(query_emb, dtype=np.float32)
+        if embeddings.dtype == np.float32:
+            return embeddings @ q
+        
+        scores = np.empty(len(embeddings), dtype=np.float32)
+        buf = np.empty((min(DENSE_SCORE_BLOCK, len(embeddings)), embeddings.shape[1]), dtype=np.float32)
+        for start in range(0, len(embeddings), DENSE_SCORE_BLOCK):
+            block = embeddings[start:start + DENSE_SCORE_BLOCK]
+            upcast = buf[:len(block)]
+            np.copyto(upcast, block)  # Reuse one float32 buffer instead of allocating per block
+            np.dot(upcast, q, out=scores[start:start + len(block)])
+        if embeddings.dtype == np.int8:
+            scores *= self.index["embedding_scales"]  # Query stays float32: only the index is quantized
+        return scores
+    
+    def _rerank_cache_key(self, query: str, candidates: List[Tuple[str, Dict, float]], topn: int) -> bytes:
+        """Hash of query, candidate chunk ids, topn and index build (ids are only stable within one build)."""
+        h = hashlib.blake2b(digest_size=16)
+        h.update(f"{self.index.get('built_at', '') if self.index else ''}|{topn}|{query}".encode("utf-8"))
+        for _, meta, _ in candidates:
+            h.update(f"|{meta['doc_id']}:{meta['chunk_id']}".encode("utf-8"))
+        return h.digest()
+    
     def rerank(self, query: str, candidates: List[Tuple[str, Dict, float]], topn: int = MAX_CHUNKS_RERANK) -> List[Tuple[str, Dict, float]]:
         """
         Neural reranking using Qwen3-Reranker-4B on Regolo GPU.
@@ -317,19 +980,21 @@ class KnowledgeBaseRAG:
         if not candidates:
             return []
         
+        # Repeated queries over the same candidates skip the (billed) reranker
+        cache_key = self._rerank_cache_key(query, candidates, topn)
+        with self._rerank_cache_lock:
+            cached = self._rerank_cache.get(cache_key)
+            if cached and time.time() - cached[0] < RERANK_CACHE_TTL:
+                self._rerank_cache.move_to_end(cache_key)
+                return list(cached[1])
+        
         # Extract just the text chunks for reranking
         chunks = [c[0] for c in candidates]
         
         try:
-            import requests
-            
             # Call Regolo rerank API directly
-            response = requests.post(
+            response = http_session.post(
                 f"{REGOLO_BASE_URL}/rerank",
-                headers={
-                    "Authorization": f"Bearer {REGOLO_API_KEY}",
-                    "Content-Type": "application/json"
-                },
                 json={
                     "model": RERANK_MODEL,
                     "query": query,
@@ -354,7 +1019,13 @@ class KnowledgeBaseRAG:
             
             # Track cost
             self.metrics["rerank_queries"] += 1
-            self.metrics["cost_total_eur"] += PRICING.get(RERANK_MODEL, {}).get("per_query", 0.01)
+            self.metrics["cost_total_eur"] += RERANK_PRICE_PER_QUERY
+            
+            with self._rerank_cache_lock:
+                self._rerank_cache[cache_key] = (time.time(), reranked)
+                self._rerank_cache.move_to_end(cache_key)
+                if len(self._rerank_cache) > RERANK_CACHE_SIZE:
+                    self._rerank_cache.popitem(last=False)
             
             return reranked
         
@@ -367,62 +1038,84 @@ class KnowledgeBaseRAG:
     def generate_answer(self, query: str, context_chunks: List[Tuple[str, Dict, float]]) -> Dict:
         """
         Generate final answer using Llama-3.1-8B-Instruct on Regolo GPU.
-        Returns: {answer, sources, cost, latency}
+        Returns: {answer, sources, cost, latency, error}
+        """
+        for event in self.generate_answer_stream(query, context_chunks):
+            if "result" in event:
+                return event["result"]
+    
+    def generate_answer_stream(self, query: str, context_chunks: List[Tuple[str, Dict, float]]) -> Iterator[Dict]:
+        """
+        Stream the final answer as tokens arrive from Regolo.
+        Yields: {"delta": text} per token chunk, then {"result": {answer, sources, cost, latency, error}}
         """
         if not context_chunks:
-            return {
+            yield {"result": {
                 "answer": "❌ I couldn't find relevant information in the knowledge base to answer your question.\n\nTry:\n• Rephrasing your question\n• Using different keywords\n• Checking if the topic exists in the knowledge base",
                 "sources": [],
                 "cost_eur": 0.0,
-                "latency_ms": 0
-            }
+                "latency_ms": 0,
+                "ttft_ms": 0,
+                "error": False
+            }}
+            return
         
-        # Build context from top chunks
+        # Build context from top chunks in document order (the reranker already chose them),
+        # so the same chunk set always yields a byte-identical prompt prefix for server-side KV reuse
         context = "\n\n".join([
-            f"[Source: {meta['source']}]\n{chunk}"
-            for chunk, meta, score in context_chunks
+            f"[Source: {meta['source']} #{meta['chunk_id']}]\n{chunk}"
+            for chunk, meta, score in sorted(context_chunks, key=lambda c: (c[1]["doc_id"], c[1]["chunk_id"]))
         ])
         
-        # Prompt engineering for enterprise knowledge base
-        prompt = f"""You are a helpful knowledge base assistant for an enterprise company.
-Your task is to answer questions based ONLY on the provided context.
-
-**Rules:**
-1. Answer concisely and accurately based on the context
-2. If the context doesn't contain enough information, say so clearly
-3. Use bullet points for lists or multiple items
-4. Cite specific sources when making claims
-5. If uncertain, express that uncertainty
-6. Use professional language appropriate for enterprise setting
-
-**Context:**
+        # Stable instructions first, variable context next, question last
+        prompt = f"""**Context:**
 {context}
 
 **Question:** {query}
 
 **Answer:**"""
         
-        # Generate via Regolo
+        # Generate via Regolo (streamed; usage arrives in the final chunk)
         t0 = time.time()
+        ttft_ms = 0
+        parts = []
+        failed = False
         try:
-            response = client.chat.completions.create(
+            stream = client.chat.completions.create(
                 model=CHAT_MODEL,
-                messages=[{"role": "user", "content": prompt}],
+                messages=[
+                    {"role": "system", "content": ANSWER_SYSTEM_PROMPT},
+                    {"role": "user", "content": prompt}
+                ],
                 temperature=0.1,
-                max_tokens=500
+                max_tokens=500,
+                stream=True,
+                stream_options={"include_usage": True}
             )
+            usage = None
+            for chunk in stream:
+                if chunk.usage:
+                    usage = chunk.usage
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not parts:
+                        ttft_ms = (time.time() - t0) * 1000
+                    parts.append(chunk.choices[0].delta.content)
+                    yield {"delta": chunk.choices[0].delta.content}
             latency_ms = (time.time() - t0) * 1000
             
-            answer = response.choices[0].message.content
+            answer = "".join(parts)
             
-            # Calculate cost
-            input_tokens = response.usage.prompt_tokens
-            output_tokens = response.usage.completion_tokens
+            # Calculate cost (count locally if the server omitted usage)
+            if usage:
+                input_tokens = usage.prompt_tokens
+                output_tokens = usage.completion_tokens
+            else:
+                system_tokens, prompt_tokens, output_tokens = count_tokens([ANSWER_SYSTEM_PROMPT, prompt, answer])
+                input_tokens = system_tokens + prompt_tokens
             
-            model_pricing = PRICING.get(CHAT_MODEL, {"input": 0.05, "output": 0.25})
             cost = (
-                (input_tokens / 1_000_000) * model_pricing["input"] +
-                (output_tokens / 1_000_000) * model_pricing["output"]
+                (input_tokens / 1_000_000) * CHAT_PRICE_INPUT +
+                (output_tokens / 1_000_000) * CHAT_PRICE_OUTPUT
             )
             
             # Track metrics
@@ -432,6 +1125,7 @@ Your task is to answer questions based ONLY on the provided context.
         except Exception as e:
             print(f"❌ Generation failed: {e}")
             answer = f"Error generating answer: {str(e)}"
+            failed = True
             cost = 0.0
             latency_ms = 0
         
@@ -446,19 +1140,51 @@ Your task is to answer questions based ONLY on the provided context.
         # Update global metrics
         self.metrics["queries_total"] += 1
         self.metrics["cost_total_eur"] += cost
-        self.metrics["latency_history"].append(latency_ms)
+        self._record_latency(latency_ms)
         
-        return {
+        yield {"result": {
             "answer": answer,
             "sources": sources,
             "cost_eur": cost,
-            "latency_ms": latency_ms
-        }
+            "latency_ms": latency_ms,
+            "ttft_ms": ttft_ms,
+            "error": failed  # Failed generations must not be cached
+        }}
     
     def query(self, question: str) -> Dict:
         """
         End-to-end RAG query pipeline.
-        Returns: {answer, sources, cost, latency, metrics}
+        Returns: {answer, sources, cost, latency, error, metrics}
+        """
+        for event in self.query_stream(question):
+            if "result" in event:
+                return event["result"]
+    
+    def _record_latency(self, latency_ms: float) -> None:
+        with self._latency_lock:
+            self._latencies[self._latency_pos] = latency_ms
+            self._latency_pos = (self._latency_pos + 1) % LATENCY_WINDOW
+            self._latency_count = min(self._latency_count + 1, LATENCY_WINDOW)
+    
+    def latency_stats(self) -> Tuple[float, float, float]:
+        """(p50, p95, mean) over the recent latency window, in ms; zeros if no queries yet."""
+        with self._latency_lock:
+            n = self._latency_count
+            window = self._latencies[:n].copy()
+        if not n:
+            return 0.0, 0.0, 0.0
+        i50, i95 = n // 2, (int(n * 0.95) if n > 20 else n - 1)
+        part = np.partition(window, (i50, i95))  # O(n) selection instead of a full sort
+        return float(part[i50]), float(part[i95]), float(window.mean())
+    
+    async def aquery(self, question: str) -> Dict:
+        """Async query(): runs the pipeline on a worker thread so callers can gather several."""
+        return await asyncio.to_thread(self.query, question)
+    
+    def query_stream(self, question: str) -> Iterator[Dict]:
+        """
+        End-to-end RAG query pipeline, streaming the generated answer.
+        Yields: {"delta": text} per token chunk, then {"result": {answer, sources, cost, latency, error, metrics}}
         """
         t0 = time.time()
         
@@ -469,14 +1195,13 @@ Your task is to answer questions based ONLY on the provided context.
         reranked = self.rerank(question, candidates, topn=MAX_CHUNKS_RERANK)
         
         # Step 3: Generate answer
-        result = self.generate_answer(question, reranked)
-        
-        # Add total metrics
-        result["total_latency_ms"] = (time.time() - t0) * 1000
-        result["retrieval_candidates"] = len(candidates)
-        result["reranked_chunks"] = len(reranked)
-        
-        return result
+        for event in self.generate_answer_stream(question, reranked):
+            if "result" in event:
+                # Add total metrics
+                event["result"]["total_latency_ms"] = (time.time() - t0) * 1000
+                event["result"]["retrieval_candidates"] = len(candidates)
+                event["result"]["reranked_chunks"] = len(reranked)
+            yield event
 
 
 # Convenience functions for CLI usage
@@ -491,6 +1216,7 @@ def build_knowledge_base(docs_path: str = KB_DOCS_PATH):
         return
     
     rag.build_index(docs)
+    rag.close_embed_cache()
     print("\n✅ Knowledge base ready! Start the bot with: python3 kb_bot.py\n")
 
 
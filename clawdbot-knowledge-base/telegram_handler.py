@@ -5,15 +5,27 @@ Integrates RAG pipeline with Telegram Bot API
 """
 
 import os
+import json
+import time
+import queue
+import atexit
+import asyncio
 import logging
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from datetime import datetime, timedelta
 from typing import Optional
 
 from telegram import Update
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 from dotenv import load_dotenv
 
-from rag_pipeline import KnowledgeBaseRAG, build_knowledge_base
+from telegram_sender import TelegramSender, TokenBucket
+from rag_pipeline import (
+    KnowledgeBaseRAG, SemanticQueryCache, build_knowledge_base,
+    EMBED_MODEL, RERANK_MODEL, CHAT_MODEL,
+    EMBED_PRICE_INPUT, RERANK_PRICE_PER_QUERY, CHAT_PRICE_INPUT, CHAT_PRICE_OUTPUT
+)
 
 load_dotenv()
 
@@ -21,31 +33,53 @@ load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
 TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
 MAX_QUERIES_PER_DAY = int(os.getenv("MAX_QUERIES_PER_DAY", "500"))
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "5"))  # Back-to-back queries allowed per user
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
 LOG_FILE = os.getenv("LOG_FILE", "./logs/kb-bot.log")
+KB_CONCURRENCY = int(os.getenv("KB_CONCURRENCY", "4"))  # /kb queries running the pipeline at once
+KB_WARM_FILE = os.getenv("KB_WARM_FILE", "./warm_queries.json")  # Questions answered into the cache at startup
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))  # Seconds between streamed message edits
 
-# Setup logging
+# Setup logging: handlers only enqueue records; a background thread does the file/console I/O
 os.makedirs(os.path.dirname(LOG_FILE) if os.path.dirname(LOG_FILE) else "./logs", exist_ok=True)
+log_queue = queue.Queue(-1)
+log_listener = QueueListener(
+    log_queue,
+    RotatingFileHandler(LOG_FILE, maxBytes=10_000_000, backupCount=5),
+    logging.StreamHandler(),
+    respect_handler_level=True
+)
+log_listener.start()
+atexit.register(log_listener.stop)
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     level=getattr(logging, LOG_LEVEL),
-    handlers=[
-        logging.FileHandler(LOG_FILE),
-        logging.StreamHandler()
-    ]
+    handlers=[QueueHandler(log_queue)]
 )
 logger = logging.getLogger(__name__)
 
 # Initialize RAG pipeline
 rag = KnowledgeBaseRAG()
+answer_cache = SemanticQueryCache(rag)
+kb_semaphore = asyncio.Semaphore(KB_CONCURRENCY)
+sender = TelegramSender()  # Rate-limited outbound messages
 
 
 class BotStats:
-    """Track bot usage statistics."""
+    """Track bot usage statistics and enforce rate limits."""
+    BUCKET_SWEEP_INTERVAL = 600  # Seconds between dropping idle (fully refilled) user buckets
+    
     def __init__(self):
         self.daily_queries = {}
         self.reset_date = datetime.now().date()
         self.user_queries = {}  # Track per-user usage
+        
+        # Rate limits: MAX_QUERIES_PER_DAY refilled continuously, bursts capped per user
+        rate = MAX_QUERIES_PER_DAY / 86400
+        self.global_bucket = TokenBucket(MAX_QUERIES_PER_DAY, rate)
+        self.user_buckets = {}
+        self.user_bucket_rate = rate
+        self.last_sweep = time.monotonic()
     
     def increment(self, user_id: Optional[int] = None):
         date = datetime.now().date()
@@ -71,18 +105,44 @@ class BotStats:
     def get_user_count(self, user_id: int):
         return self.user_queries.get(user_id, 0)
     
-    def is_limit_reached(self):
-        return self.get_today_count() >= MAX_QUERIES_PER_DAY
+    def acquire(self, user_id: int) -> float:
+        """
+        Take one query token for user_id.
+        Returns 0 if the query may proceed, otherwise seconds until it would be allowed.
+        """
+        self._sweep_buckets()
+        bucket = self.user_buckets.get(user_id)
+        if bucket is None:
+            bucket = self.user_buckets[user_id] = TokenBucket(RATE_LIMIT_BURST, self.user_bucket_rate)
+        
+        if not bucket.take():
+            return bucket.wait_time()
+        if not self.global_bucket.take():
+            bucket.refund()
+            return self.global_bucket.wait_time()
+        return 0.0
+    
+    def refund(self, user_id: int):
+        """Give back the token taken by acquire() for a query that failed."""
+        bucket = self.user_buckets.get(user_id)
+        if bucket is not None:
+            bucket.refund()
+        self.global_bucket.refund()
+    
+    def _sweep_buckets(self):
+        """Lazily forget users whose bucket has refilled (equivalent to a fresh one)."""
+        now = time.monotonic()
+        if now - self.last_sweep < self.BUCKET_SWEEP_INTERVAL:
+            return
+        self.last_sweep = now
+        self.user_buckets = {uid: b for uid, b in self.user_buckets.items() if not b.is_full()}
 
 
 stats = BotStats()
 
-
-async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle /start command."""
-    user_name = update.effective_user.first_name
-    welcome_message = f"""
-👋 **Welcome {user_name} to the Knowledge Base Bot!**
+# Static reply text, built once; {user_name} is the only per-call field
+WELCOME_TEMPLATE = f"""
+👋 **Welcome {{user_name}} to the Knowledge Base Bot!**
 
 I can help you search through company documentation, runbooks, policies, and technical guides using AI-powered retrieval.
 
@@ -104,11 +164,22 @@ All queries are processed on EU-hosted GPUs (Regolo.ai) with zero data retention
 **⚡ Powered by:**
 • Embeddings: gte-Qwen2
 • Reranking: Qwen3-Reranker-4B
-• Generation: {os.getenv('CHAT_MODEL', 'Llama-3.1-8B-Instruct')}
+• Generation: {CHAT_MODEL}
 
 Try asking me something! 🚀
 """
-    await update.message.reply_text(welcome_message, parse_mode='Markdown')
+
+STATS_MODELS_FOOTER = f"""**🚀 Models:**
+• Embed: {EMBED_MODEL}
+• Rerank: {RERANK_MODEL}
+• Chat: {CHAT_MODEL}
+"""
+
+
+async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Handle /start command."""
+    welcome_message = WELCOME_TEMPLATE.format(user_name=update.effective_user.first_name)
+    await sender.send(context.bot, update.effective_chat.id, welcome_message, parse_mode='Markdown')
 
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -116,25 +187,37 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await start_command(update, context)
 
 
+async def edit_message(message, text: str, parse_mode: Optional[str] = 'Markdown'):
+    """
+    Replace a message's text. Falls back to plain text if Telegram rejects the Markdown
+    (e.g. an unbalanced * or ` in a generated answer), and waits out one flood-control delay.
+    """
+    for attempt in range(2):
+        try:
+            await message.edit_text(text, parse_mode=parse_mode)
+            return
+        except RetryAfter as e:
+            if attempt:
+                raise
+            await asyncio.sleep(e.retry_after)
+        except BadRequest:
+            if parse_mode is None:
+                raise
+            parse_mode = None
+    await message.edit_text(text, parse_mode=parse_mode)
+
+
 async def kb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /kb <question> command."""
     
     user_id = update.effective_user.id
     user_name = update.effective_user.first_name
     
-    # Rate limiting
-    if stats.is_limit_reached():
-        await update.message.reply_text(
-            f"⚠️ **Daily query limit reached** ({MAX_QUERIES_PER_DAY} queries/day).\n\n"
-            "The limit will reset tomorrow. Contact admin to increase the limit if needed.",
-            parse_mode='Markdown'
-        )
-        return
-    
-    # Extract question
+    # Extract question (before rate limiting: an empty /kb doesn't use up quota)
     question = " ".join(context.args)
     if not question:
-        await update.message.reply_text(
+        await sender.send(
+            context.bot, update.effective_chat.id,
             "❓ **Please provide a question.**\n\n"
             "**Example:**\n"
             "`/kb What is our GDPR policy?`",
@@ -142,14 +225,59 @@ async def kb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Show "typing..." indicator
-    await update.message.chat.send_action("typing")
+    # Rate limiting
+    retry_after = stats.acquire(user_id)
+    if retry_after:
+        await sender.send(
+            context.bot, update.effective_chat.id,
+            f"⚠️ **Query rate limit reached** ({MAX_QUERIES_PER_DAY} queries/day, "
+            f"bursts of {RATE_LIMIT_BURST}).\n\n"
+            f"Try again in {max(retry_after, 1):.0f}s. Contact admin to increase the limit if needed.",
+            parse_mode='Markdown'
+        )
+        return
     
     logger.info(f"Query from {user_name} (ID: {user_id}): {question}")
     
+    message = None
     try:
-        # Query RAG pipeline
-        result = rag.query(question)
+        # Show "typing..." indicator
+        await update.message.chat.send_action("typing")
+        
+        # Query RAG pipeline, editing a placeholder message as tokens stream in
+        message = await update.message.reply_text("🔍 Searching the knowledge base...")
+        
+        # Paraphrases of a recent question are answered from the semantic cache
+        result = await asyncio.to_thread(answer_cache.get, question)
+        
+        if result is None:
+            # Cap simultaneous pipeline runs (and outbound Regolo calls) across users
+            async with kb_semaphore:
+                events = rag.query_stream(question)
+                parts = []
+                last_edit = time.monotonic()
+                
+                while True:
+                    # The pipeline is synchronous: advance it on a worker thread
+                    event = await asyncio.to_thread(next, events)
+                    if "result" in event:
+                        result = event["result"]
+                        break
+                
+                    parts.append(event["delta"])
+                    if time.monotonic() - last_edit >= STREAM_EDIT_INTERVAL:
+                        last_edit = time.monotonic()
+                        try:
+                            # Plain text while streaming: partial Markdown may not parse
+                            await message.edit_text(f"📚 Knowledge Base Answer\n\n{''.join(parts)} ▌")
+                        except RetryAfter as e:
+                            # Flood control: skip progress edits until Telegram allows them again
+                            last_edit = time.monotonic() + e.retry_after
+                        except BadRequest:
+                            pass
+                
+                if not result.get("error"):
+                    await asyncio.to_thread(answer_cache.put, question, result)
         
         # Format response
         response = f"📚 **Knowledge Base Answer**\n\n{result['answer']}\n\n"
@@ -164,10 +292,13 @@ async def kb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Add metrics
         response += f"⏱️ Retrieved in {result['total_latency_ms']:.0f}ms | Cost: €{result['cost_eur']:.4f}"
         
-        await update.message.reply_text(response, parse_mode='Markdown')
+        await edit_message(message, response)
         
-        # Update stats
-        stats.increment(user_id)
+        # Update stats (a failed generation gives its token back instead of counting)
+        if result.get("error"):
+            stats.refund(user_id)
+        else:
+            stats.increment(user_id)
         
         logger.info(
             f"Response sent | Latency: {result['total_latency_ms']:.0f}ms | "
@@ -176,15 +307,23 @@ async def kb_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     except Exception as e:
         logger.error(f"Error processing query: {e}", exc_info=True)
-        await update.message.reply_text(
+        stats.refund(user_id)
+        error_text = (
             f"❌ **Error processing your question:**\n\n"
             f"`{str(e)[:200]}`\n\n"
             "Please try:\n"
             "• Rephrasing your question\n"
             "• Using simpler keywords\n"
-            "• Contacting admin if the issue persists",
-            parse_mode='Markdown'
+            "• Contacting admin if the issue persists"
         )
+        if message is not None:
+            # Replace the placeholder (and any partial streamed answer) with the error
+            try:
+                await edit_message(message, error_text)
+                return
+            except Exception as edit_error:
+                logger.warning(f"Could not edit placeholder message: {edit_error}")
+        await sender.send(context.bot, update.effective_chat.id, error_text, parse_mode='Markdown')
 
 
 async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -198,14 +337,7 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_queries = stats.get_user_count(user_id)
     
     # Calculate latency percentiles
-    latencies = rag.metrics["latency_history"]
-    if latencies:
-        latencies_sorted = sorted(latencies)
-        p50 = latencies_sorted[len(latencies) // 2]
-        p95 = latencies_sorted[int(len(latencies) * 0.95)] if len(latencies) > 20 else latencies_sorted[-1]
-        avg = sum(latencies) / len(latencies)
-    else:
-        p50 = p95 = avg = 0
+    p50, p95, avg = rag.latency_stats()
     
     # Index info
     index_info = ""
@@ -222,10 +354,10 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 """
     
     # Cost breakdown
-    embed_cost = (rag.metrics["embedding_tokens"] / 1_000_000) * 0.05
-    rerank_cost = rag.metrics["rerank_queries"] * 0.01
-    gen_input_cost = (rag.metrics["generation_input_tokens"] / 1_000_000) * 0.05
-    gen_output_cost = (rag.metrics["generation_output_tokens"] / 1_000_000) * 0.25
+    embed_cost = (rag.metrics["embedding_tokens"] / 1_000_000) * EMBED_PRICE_INPUT
+    rerank_cost = rag.metrics["rerank_queries"] * RERANK_PRICE_PER_QUERY
+    gen_input_cost = (rag.metrics["generation_input_tokens"] / 1_000_000) * CHAT_PRICE_INPUT
+    gen_output_cost = (rag.metrics["generation_output_tokens"] / 1_000_000) * CHAT_PRICE_OUTPUT
     
     response = f"""
 📊 **Knowledge Base Statistics**
@@ -252,13 +384,9 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 **📊 Projected monthly cost:**
 €{(total_cost/max(total_queries,1)) * MAX_QUERIES_PER_DAY * 30:.2f} (at current rate)
 
-**🚀 Models:**
-• Embed: {os.getenv('EMBED_MODEL')}
-• Rerank: {os.getenv('RERANK_MODEL')}
-• Chat: {os.getenv('CHAT_MODEL')}
-"""
+{STATS_MODELS_FOOTER}"""
     
-    await update.message.reply_text(response, parse_mode='Markdown')
+    await sender.send(context.bot, update.effective_chat.id, response, parse_mode='Markdown')
 
 
 async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -266,28 +394,35 @@ async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     # Admin check (only configured chat ID can rebuild)
     if str(update.effective_chat.id) != TELEGRAM_CHAT_ID:
-        await update.message.reply_text(
+        await sender.send(
+            context.bot, update.effective_chat.id,
             "❌ **Unauthorized.**\n\nOnly admin can rebuild the index.",
             parse_mode='Markdown'
         )
         return
     
-    await update.message.reply_text(
+    await sender.send(
+        context.bot, update.effective_chat.id,
         "🔄 **Rebuilding knowledge base index...**\n\n"
         "This may take 1-2 minutes depending on document count.",
         parse_mode='Markdown'
     )
     
     try:
-        # Rebuild index
+        # Rebuild index on a worker thread so other handlers keep running
         t0 = datetime.now()
-        build_knowledge_base()
+        await asyncio.to_thread(build_knowledge_base)
         elapsed = (datetime.now() - t0).total_seconds()
         
-        # Reload index
-        rag.load_index()
+        # Reload index; cached answers refer to the old one. The embedding cache
+        # connection is closed too and reopened by the next query
+        await asyncio.to_thread(rag.load_index)
+        rag.close_embed_cache()
+        answer_cache.clear()
+        context.application.create_task(warm_answer_cache())
         
-        await update.message.reply_text(
+        await sender.send(
+            context.bot, update.effective_chat.id,
             f"✅ **Index rebuilt successfully**\n\n"
             f"├─ Build time: {elapsed:.1f}s\n"
             f"├─ Documents: {rag.index['num_docs']}\n"
@@ -301,18 +436,61 @@ async def update_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         
     except Exception as e:
         logger.error(f"Error rebuilding index: {e}", exc_info=True)
-        await update.message.reply_text(
+        await sender.send(
+            context.bot, update.effective_chat.id,
             f"❌ **Error rebuilding index:**\n\n`{str(e)[:200]}`",
             parse_mode='Markdown'
         )
 
 
+async def warm_answer_cache():
+    """Answer the questions in KB_WARM_FILE into the semantic cache, so early users get cache hits."""
+    if not os.path.exists(KB_WARM_FILE):
+        return
+    with open(KB_WARM_FILE, encoding="utf-8") as f:
+        questions = json.load(f)
+    
+    warmed = 0
+    
+    async def warm(question):
+        nonlocal warmed
+        try:
+            if await asyncio.to_thread(answer_cache.get, question) is not None:
+                warmed += 1
+                return
+            async with kb_semaphore:
+                result = await asyncio.to_thread(rag.query, question)
+            # rag.query reports generation failures in the result instead of raising
+            if result.get("error"):
+                logger.warning(f"Cache warm-up failed for {question!r}: {result['answer']}")
+                return
+            await asyncio.to_thread(answer_cache.put, question, result)
+            warmed += 1
+        except Exception as e:
+            logger.warning(f"Cache warm-up failed for {question!r}: {e}")
+    
+    t0 = time.monotonic()
+    await asyncio.gather(*[warm(q) for q in questions])
+    logger.info(f"🔥 Answer cache warmed with {warmed}/{len(questions)} queries in {time.monotonic() - t0:.1f}s")
+
+
+async def start_background_tasks(application: Application):
+    """Runs once the bot's event loop is up; warm-up doesn't delay polling."""
+    application.create_task(warm_answer_cache())
+
+
+async def flush_outbound(application: Application):
+    """Deliver queued outbound messages before the bot shuts down."""
+    await sender.flush()
+
+
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle errors."""
     logger.error(f"Update {update} caused error {context.error}", exc_info=context.error)
     
-    if update and update.effective_message:
-        await update.effective_message.reply_text(
+    if update and update.effective_chat:
+        await sender.send(
+            context.bot, update.effective_chat.id,
             "❌ An unexpected error occurred. Please try again or contact admin."
         )
 
@@ -334,7 +512,13 @@ def main():
             return
     
     # Create application
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .post_init(start_background_tasks)
+        .post_stop(flush_outbound)
+        .build()
+    )
     
     # Add handlers
     application.add_handler(CommandHandler("start", start_command))
@@ -350,9 +534,9 @@ def main():
     logger.info("=" * 60)
     logger.info(f"🤖 Bot username: @{application.bot.username if hasattr(application.bot, 'username') else 'N/A'}")
     logger.info(f"├─ Models:")
-    logger.info(f"│  ├─ Embeddings: {os.getenv('EMBED_MODEL')}")
-    logger.info(f"│  ├─ Reranking: {os.getenv('RERANK_MODEL')}")
-    logger.info(f"│  └─ Chat: {os.getenv('CHAT_MODEL')}")
+    logger.info(f"│  ├─ Embeddings: {EMBED_MODEL}")
+    logger.info(f"│  ├─ Reranking: {RERANK_MODEL}")
+    logger.info(f"│  └─ Chat: {CHAT_MODEL}")
     logger.info(f"├─ Knowledge base: {rag.index['num_docs']} docs, {rag.index['num_chunks']} chunks")
     logger.info(f"└─ Daily query limit: {MAX_QUERIES_PER_DAY}")
     logger.info("=" * 60)
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Outbound message sender for the Telegram bot
+Respects Bot API limits (~30 messages/s overall, ~1 message/s per chat) and joins
+messages queued for the same chat into one, under the 4096-character limit
+"""
+
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from telegram import Bot
+from telegram.error import RetryAfter
+
+MAX_MESSAGE_LEN = 4000  # Headroom under Telegram's 4096-character limit
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """Token-bucket limiter: holds up to `capacity` tokens, refilled at `rate` tokens/s."""
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+    
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def take(self, cost: float = 1) -> bool:
+        self._refill()
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+    
+    def refund(self, cost: float = 1):
+        self.tokens = min(self.capacity, self.tokens + cost)
+    
+    def wait_time(self, cost: float = 1) -> float:
+        """Seconds until `cost` tokens are available."""
+        self._refill()
+        return max(0.0, (cost - self.tokens) / self.rate)
+    
+    def is_full(self) -> bool:
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+class TelegramSender:
+    """
+    Queues outbound messages per chat and delivers them in order from one task per chat,
+    throttled by a global and a per-chat token bucket. Messages that pile up while a chat
+    is throttled are sent as a single joined message.
+    """
+    def __init__(self, global_rate: float = 30, chat_rate: float = 1):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_buckets: Dict[int, TokenBucket] = {}
+        self.pending: Dict[int, List[Tuple[str, Optional[str]]]] = {}
+        self.workers: Dict[int, asyncio.Task] = {}
+    
+    async def send(self, bot: Bot, chat_id: int, text: str, parse_mode: Optional[str] = None):
+        """Queue a message for chat_id; returns immediately."""
+        self.pending.setdefault(chat_id, []).append((text, parse_mode))
+        if chat_id not in self.workers:
+            self.workers[chat_id] = asyncio.create_task(self._drain(bot, chat_id))
+    
+    async def flush(self):
+        """Wait until every queued message has been delivered."""
+        await asyncio.gather(*self.workers.values(), return_exceptions=True)
+    
+    async def _drain(self, bot: Bot, chat_id: int):
+        bucket = self.chat_buckets.get(chat_id)
+        if bucket is None:
+            self._sweep_buckets()
+            bucket = self.chat_buckets[chat_id] = TokenBucket(1, self.chat_rate)
+        
+        try:
+            while self.pending.get(chat_id):
+                await self._acquire(bucket)
+                await self._acquire(self.global_bucket)
+                text, parse_mode = self._next_batch(chat_id)
+                
+                while True:
+                    try:
+                        await bot.send_message(chat_id, text, parse_mode=parse_mode)
+                        break
+                    except RetryAfter as e:
+                        logger.warning(f"Rate limited by Telegram, retrying chat {chat_id} in {e.retry_after}s")
+                        await asyncio.sleep(e.retry_after)
+                    except Exception as e:
+                        logger.error(f"Failed to send message to chat {chat_id}: {e}", exc_info=True)
+                        break
+        finally:
+            del self.workers[chat_id]
+    
+    def _next_batch(self, chat_id: int) -> Tuple[str, Optional[str]]:
+        """Pop the next message, joined with following ones that share its parse mode and fit."""
+        queue = self.pending[chat_id]
+        text, parse_mode = queue.pop(0)
+        while queue and queue[0][1] == parse_mode and len(text) + 1 + len(queue[0][0]) <= MAX_MESSAGE_LEN:
+            text += "\n" + queue.pop(0)[0]
+        if not queue:
+            del self.pending[chat_id]
+        return text, parse_mode
+    
+    @staticmethod
+    async def _acquire(bucket: TokenBucket):
+        while not bucket.take():
+            await asyncio.sleep(bucket.wait_time())
+    
+    def _sweep_buckets(self):
+        """Forget idle chats whose bucket has refilled (equivalent to a fresh one)."""
+        if len(self.chat_buckets) > 1000:
+            self.chat_buckets = {cid: b for cid, b in self.chat_buckets.items() if not b.is_full()}
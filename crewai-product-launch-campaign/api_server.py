@@ -1,27 +1,65 @@
 from flask import Flask, request, jsonify
 import uuid
+import json
 import threading
+import atexit
 import os
+from concurrent.futures import ThreadPoolExecutor
+from cachetools import TTLCache
 from crew import product_launch_crew
 
 app = Flask(__name__)
-jobs = {}  # In-memory job storage (use Redis in production)
+
+JOB_TTL = int(os.getenv('JOB_TTL', 3600))  # Seconds a job (and its result) stays retrievable
+JOB_STORE_MAXSIZE = int(os.getenv('JOB_STORE_MAXSIZE', 10_000))
+REDIS_URL = os.getenv('REDIS_URL')
+CREW_MAX_CONCURRENCY = int(os.getenv('CREW_MAX_CONCURRENCY', 4))  # Crews running at once (LLM concurrency budget)
+CREW_QUEUE_SIZE = int(os.getenv('CREW_QUEUE_SIZE', 100))  # Accepted jobs waiting for a worker
+
+# Crews run on a fixed pool; the semaphore bounds running + queued jobs so bursts get a 503
+EXECUTOR = ThreadPoolExecutor(max_workers=CREW_MAX_CONCURRENCY, thread_name_prefix="crew")
+_job_slots = threading.BoundedSemaphore(CREW_MAX_CONCURRENCY + CREW_QUEUE_SIZE)
+atexit.register(lambda: EXECUTOR.shutdown(wait=True))
+
+# Job storage: Redis when REDIS_URL is set, otherwise a bounded in-memory TTL cache
+if REDIS_URL:
+    import redis
+    redis_client = redis.Redis.from_url(REDIS_URL)
+else:
+    jobs = TTLCache(maxsize=JOB_STORE_MAXSIZE, ttl=JOB_TTL)
+    _jobs_lock = threading.RLock()  # TTLCache is not thread-safe; the crew runs on worker threads
+
+def set_job(job_id, job):
+    """Store job state, expiring after JOB_TTL seconds"""
+    if REDIS_URL:
+        redis_client.set(f"job:{job_id}", json.dumps(job), ex=JOB_TTL)
+    else:
+        with _jobs_lock:
+            jobs[job_id] = job
+
+def get_job(job_id):
+    """Return job state, or None if unknown or expired"""
+    if REDIS_URL:
+        raw = redis_client.get(f"job:{job_id}")
+        return json.loads(raw) if raw else None
+    with _jobs_lock:
+        return jobs.get(job_id)
 
 def run_crew_async(job_id, inputs):
     """Execute crew in background thread"""
     try:
         result = product_launch_crew.kickoff(inputs=inputs)
-        jobs[job_id] = {
+        set_job(job_id, {
             "status": "completed", 
             "result": str(result),
             "inputs": inputs
-        }
+        })
     except Exception as e:
-        jobs[job_id] = {
+        set_job(job_id, {
             "status": "failed", 
             "error": str(e),
             "inputs": inputs
-        }
+        })
 
 @app.route('/kickoff', methods=['POST'])
 def kickoff():
@@ -30,17 +68,24 @@ def kickoff():
     product_name = data.get('product_name', 'New Product')
     market_segment = data.get('market_segment', 'General Market')
 
+    # Reject instead of queuing forever when the backlog is full
+    if not _job_slots.acquire(blocking=False):
+        return jsonify({
+            "status": "busy",
+            "message": "Too many crews in progress, retry later"
+        }), 503
+
     # Generate unique job ID
     job_id = str(uuid.uuid4())
-    jobs[job_id] = {"status": "running", "result": None}
+    set_job(job_id, {"status": "running", "result": None})
 
     # Run crew in background
     inputs = {
         "product_name": product_name,
         "market_segment": market_segment
     }
-    thread = threading.Thread(target=run_crew_async, args=(job_id, inputs))
-    thread.start()
+    future = EXECUTOR.submit(run_crew_async, job_id, inputs)
+    future.add_done_callback(lambda _: _job_slots.release())
 
     return jsonify({
         "job_id": job_id,
@@ -51,7 +96,7 @@ def kickoff():
 @app.route('/status/<job_id>', methods=['GET'])
 def get_status(job_id):
     """Poll job status and retrieve results"""
-    job = jobs.get(job_id, {"status": "not_found"})
+    job = get_job(job_id) or {"status": "not_found"}
     return jsonify(job)
 
 @app.route('/health', methods=['GET'])
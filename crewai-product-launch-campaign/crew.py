@@ -3,13 +3,13 @@ load_dotenv()
 
 from crewai import Crew, Process
 from agents import competitive_analyst, copywriter, campaign_manager
-from tasks import analysis_task, copy_task, strategy_task
+from tasks import analysis_task, copy_task, strategy_skeleton_task, strategy_task
 
 # Assemble the launch crew
 product_launch_crew = Crew(
     agents=[competitive_analyst, copywriter, campaign_manager],
-    tasks=[analysis_task, copy_task, strategy_task],
-    process=Process.sequential,  # Tasks execute in dependency order
+    tasks=[analysis_task, copy_task, strategy_skeleton_task, strategy_task],
+    process=Process.sequential,  # Tasks execute in dependency order; async tasks run concurrently
     verbose=True
 )
 
@@ -22,18 +22,31 @@ copy_task = Task(
     All copy must highlight our competitive advantages.""",
     expected_output="Complete marketing copy package in markdown format with clear sections.",
     agent=copywriter,
-    context=[analysis_task]  # Depends on analyst's output
+    context=[analysis_task],  # Depends on analyst's output
+    async_execution=True  # Runs alongside the strategy draft
 )
 
-# Task 3: Campaign Strategy
-strategy_task = Task(
-    description="""Design a complete 30-day product launch campaign including:
+# Task 3: Campaign Strategy Draft (needs only the analysis, so it runs in parallel with the copy)
+strategy_skeleton_task = Task(
+    description="""Draft a 30-day product launch campaign including:
     - Channel mix and budget allocation
     - Week-by-week timeline
     - Key metrics and KPIs (CAC, conversion rate, LTV targets)
     - A/B testing plan
-    Use the positioning from analysis and copy assets created.""",
+    Use the positioning from the competitive analysis.""",
+    expected_output="A campaign plan draft with timeline, budget, and success metrics.",
+    agent=campaign_manager,
+    context=[analysis_task],
+    async_execution=True
+)
+
+# Task 4: Campaign Strategy
+strategy_task = Task(
+    description="""Finalize the 30-day product launch campaign from the strategy draft:
+    - Map the copy assets (landing page, emails, ads) onto the channels and weeks
+    - Adjust the budget allocation and A/B testing plan to the assets available
+    - Keep the KPIs (CAC, conversion rate, LTV targets)""",
     expected_output="A detailed campaign plan with timeline, budget, and success metrics.",
     agent=campaign_manager,
-    context=[analysis_task, copy_task]  # Depends on both previous outputs
+    context=[strategy_skeleton_task, copy_task]  # Waits for both parallel tasks
 )
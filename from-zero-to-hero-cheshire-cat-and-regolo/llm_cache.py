@@ -0,0 +1,139 @@
+"""
+Disk-backed response cache for Regolo chat completions
+Identical requests (model, temperature, max_tokens, messages) skip the API call
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List, Dict, Optional
+
+
+CACHE_PATH = os.environ.get("REGOLO_CACHE_PATH", "./.cache/llm.sqlite3")
+CACHE_TTL = int(os.environ.get("REGOLO_CACHE_TTL", "86400"))  # 24h
+CACHE_MAX_ENTRIES = int(os.environ.get("REGOLO_CACHE_MAX_ENTRIES", "10000"))
+MEMORY_MAX_ENTRIES = 256  # Hot entries also kept in-process
+
+
+def make_key(
+    model: str,
+    temperature: float,
+    max_tokens: Optional[int],
+    messages: List[Dict[str, str]]
+) -> str:
+    """SHA-256 of the request fields that determine the completion."""
+    raw = json.dumps(
+        {"m": model, "t": temperature, "mx": max_tokens, "msgs": messages},
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    SQLite-backed cache with TTL expiry and LRU eviction,
+    fronted by a small in-memory LRU for repeated hits in one process.
+    Hits never write to disk: access times are batched into the next set().
+    """
+
+    def __init__(
+        self,
+        path: str = CACHE_PATH,
+        ttl: int = CACHE_TTL,
+        max_entries: int = CACHE_MAX_ENTRIES
+    ):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        # WAL + NORMAL: commits append to the log without an fsync each
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.commit()
+        self._memory = OrderedDict()  # key -> (expires_at, value)
+        self._touched = {}  # key -> last access time, not yet written to disk
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached completion, or None on miss/expiry."""
+        now = time.time()
+        with self._lock:
+            hit = self._memory.get(key)
+            if hit and hit[0] > now:
+                self._memory.move_to_end(key)
+                self._touched[key] = now
+                return hit[1]
+
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+            if not row:
+                return None
+            if row[1] <= now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+
+            # Access time is kept in memory and written with the next set(): a hit costs no write
+            self._touched[key] = now
+            self._remember(key, row[1], row[0])
+            return row[0]
+
+    def set(self, key: str, value: str, expire: Optional[int] = None) -> None:
+        """Store a completion for `expire` seconds (default: the cache TTL)."""
+        now = time.time()
+        expires_at = now + (expire if expire is not None else self.ttl)
+        with self._lock:
+            # Flush pending access times first so LRU eviction sees real recency
+            if self._touched:
+                self._conn.executemany(
+                    "UPDATE responses SET accessed_at = ? WHERE key = ?",
+                    [(accessed_at, k) for k, accessed_at in self._touched.items()],
+                )
+                self._touched.clear()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, expires_at, accessed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, expires_at, now),
+            )
+            # Evict least recently used entries beyond the size limit
+            self._conn.execute(
+                "DELETE FROM responses WHERE key IN ("
+                "SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+            self._remember(key, expires_at, value)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+            self._conn.commit()
+            self._memory.clear()
+            self._touched.clear()
+
+    def _remember(self, key: str, expires_at: float, value: str) -> None:
+        self._memory[key] = (expires_at, value)
+        self._memory.move_to_end(key)
+        if len(self._memory) > MEMORY_MAX_ENTRIES:
+            self._memory.popitem(last=False)
+
+
+_cache: Optional[LLMCache] = None
+
+
+def get_cache() -> LLMCache:
+    """Process-wide cache instance, opened on first use."""
+    global _cache
+    if _cache is None:
+        _cache = LLMCache()
+    return _cache
@@ -4,20 +4,92 @@ A minimal helper to call Regolo's /chat/completions endpoint
 """
 
 import os
+import json
+import asyncio
+import httpx
 import requests
-from typing import List, Dict, Optional
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from typing import List, Dict, Optional, Tuple, AsyncIterator
+
+from llm_cache import get_cache, make_key
 
 
 BASE_URL = "https://api.regolo.ai/v1"
 API_KEY = os.environ.get("REGOLO_API_KEY")
 MODEL = os.environ.get("REGOLO_MODEL", "Llama-3.3-70B-Instruct")
 
+# Shared session: reuses TCP/TLS connections across calls, retries transient errors
+_SESSION = requests.Session()
+_SESSION.headers["Connection"] = "keep-alive"
+_SESSION.mount("https://", HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.2,
+        status_forcelist=(429, 500, 502, 503, 504),
+        allowed_methods=frozenset({"POST"}),
+        raise_on_status=False,
+    ),
+))
+
+# Async clients for concurrent calls (HTTP/2 multiplexes one connection). Connections
+# belong to the event loop that opened them, so there is one client per running loop
+_ACLIENTS: Dict[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, asyncio.Task]] = {}
+
+
+async def _close_at_shutdown(loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient) -> None:
+    """
+    Park until the loop cancels its leftover tasks on shutdown (asyncio.run does),
+    then close the client inside the loop that owns its connections.
+    """
+    try:
+        await loop.create_future()
+    finally:
+        _ACLIENTS.pop(loop, None)
+        await client.aclose()
+
+
+def _get_aclient() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    entry = _ACLIENTS.get(loop)
+    if entry is None:
+        client = httpx.AsyncClient(
+            base_url=BASE_URL,
+            http2=True,
+            timeout=30,
+            limits=httpx.Limits(max_connections=32, max_keepalive_connections=16),
+        )
+        entry = _ACLIENTS[loop] = (client, loop.create_task(_close_at_shutdown(loop, client)))
+    return entry[0]
+
+
+_SSE_DONE = object()  # End-of-stream marker returned by _parse_sse_line
+
+
+def _parse_sse_line(line: str):
+    """
+    Delta text carried by one Server-Sent Events line, None if it carries none
+    (keep-alives, comments, role or usage-only chunks), or _SSE_DONE at [DONE].
+    """
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return _SSE_DONE
+    chunk = json.loads(data)
+    if not chunk.get("choices"):
+        return None
+    return chunk["choices"][0].get("delta", {}).get("content")
+
 
 def regolo_chat(
     messages: List[Dict[str, str]], 
     temperature: float = 0.2,
     max_tokens: Optional[int] = None,
-    model: Optional[str] = None
+    model: Optional[str] = None,
+    cache_enabled: bool = True
 ) -> str:
     """
     Call Regolo's OpenAI-compatible /chat/completions endpoint.
@@ -27,6 +99,7 @@ def regolo_chat(
         temperature: Sampling temperature (0.0 to 2.0)
         max_tokens: Maximum tokens to generate (optional)
         model: Override default model (optional)
+        cache_enabled: Reuse a cached completion for an identical request
 
     Returns:
         String content of the first completion choice
@@ -41,6 +114,13 @@ def regolo_chat(
             "Get your key from https://regolo.ai dashboard"
         )
 
+    key = None
+    if cache_enabled:
+        key = make_key(model or MODEL, temperature, max_tokens, messages)
+        cached = get_cache().get(key)
+        if cached is not None:
+            return cached
+
     payload = {
         "model": model or MODEL,
         "temperature": temperature,
@@ -50,7 +130,7 @@ def regolo_chat(
     if max_tokens:
         payload["max_tokens"] = max_tokens
 
-    response = requests.post(
+    response = _SESSION.post(
         f"{BASE_URL}/chat/completions",
         headers={"Authorization": f"Bearer {API_KEY}"},
         json=payload,
@@ -58,7 +138,59 @@ def regolo_chat(
     )
     response.raise_for_status()
     data = response.json()
-    return data["choices"][0]["message"]["content"]
+    content = data["choices"][0]["message"]["content"]
+
+    if key:
+        get_cache().set(key, content)
+    return content
+
+
+async def regolo_chat_async(
+    messages: List[Dict[str, str]], 
+    temperature: float = 0.2,
+    max_tokens: Optional[int] = None,
+    model: Optional[str] = None,
+    cache_enabled: bool = True
+) -> str:
+    """
+    Async variant of regolo_chat: independent prompts can run together with asyncio.gather.
+    Shares the response cache with regolo_chat. Same arguments and errors
+    (httpx.HTTPStatusError instead of requests.HTTPError).
+    """
+    if not API_KEY:
+        raise RuntimeError(
+            "REGOLO_API_KEY environment variable is not set. "
+            "Get your key from https://regolo.ai dashboard"
+        )
+
+    key = None
+    if cache_enabled:
+        key = make_key(model or MODEL, temperature, max_tokens, messages)
+        # The SQLite cache blocks (and locks): keep it off the event loop
+        cached = await asyncio.to_thread(lambda: get_cache().get(key))
+        if cached is not None:
+            return cached
+
+    payload = {
+        "model": model or MODEL,
+        "temperature": temperature,
+        "messages": messages,
+    }
+
+    if max_tokens:
+        payload["max_tokens"] = max_tokens
+
+    response = await _get_aclient().post(
+        "/chat/completions",
+        headers={"Authorization": f"Bearer {API_KEY}"},
+        json=payload,
+    )
+    response.raise_for_status()
+    content = response.json()["choices"][0]["message"]["content"]
+
+    if key:
+        await asyncio.to_thread(lambda: get_cache().set(key, content))
+    return content
 
 
 def regolo_stream_chat(
@@ -68,7 +200,7 @@ def regolo_stream_chat(
 ):
     """
     Call Regolo's streaming endpoint (if available).
-    Yields text chunks as they arrive.
+    Parses the Server-Sent Events stream and yields text chunks as they arrive.
     """
     if not API_KEY:
         raise RuntimeError("REGOLO_API_KEY environment variable is not set")
@@ -80,7 +212,7 @@ def regolo_stream_chat(
         "stream": True,
     }
 
-    response = requests.post(
+    response = _SESSION.post(
         f"{BASE_URL}/chat/completions",
         headers={"Authorization": f"Bearer {API_KEY}"},
         json=payload,
@@ -90,8 +222,45 @@ def regolo_stream_chat(
     response.raise_for_status()
 
     for line in response.iter_lines():
-        if line:
-            yield line.decode('utf-8')
+        content = _parse_sse_line(line.decode("utf-8"))
+        if content is _SSE_DONE:
+            break
+        if content:
+            yield content
+
+
+async def regolo_stream_chat_async(
+    messages: List[Dict[str, str]], 
+    temperature: float = 0.2,
+    model: Optional[str] = None
+) -> AsyncIterator[str]:
+    """
+    Async variant of regolo_stream_chat for use from async handlers.
+    Yields text chunks as they arrive.
+    """
+    if not API_KEY:
+        raise RuntimeError("REGOLO_API_KEY environment variable is not set")
+
+    payload = {
+        "model": model or MODEL,
+        "temperature": temperature,
+        "messages": messages,
+        "stream": True,
+    }
+
+    async with _get_aclient().stream(
+        "POST",
+        "/chat/completions",
+        headers={"Authorization": f"Bearer {API_KEY}"},
+        json=payload,
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            content = _parse_sse_line(line)
+            if content is _SSE_DONE:
+                break
+            if content:
+                yield content
 
 
 if __name__ == "__main__":
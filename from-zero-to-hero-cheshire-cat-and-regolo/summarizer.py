@@ -15,12 +15,26 @@ except ImportError:
     # Fallback for when running inside Cheshire Cat
     import requests
 
+    _SESSION = requests.Session()  # Keep-alive: reuse the TLS connection across tool calls
+
+    try:
+        from llm_cache import get_cache, make_key
+    except ImportError:
+        get_cache = None
+
     def regolo_chat(messages, temperature=0.2):
         API_KEY = os.environ.get("REGOLO_API_KEY")
         if not API_KEY:
             return "ERROR: REGOLO_API_KEY not set"
 
-        response = requests.post(
+        key = None
+        if get_cache:
+            key = make_key("Llama-3.3-70B-Instruct", temperature, None, messages)
+            cached = get_cache().get(key)
+            if cached is not None:
+                return cached
+
+        response = _SESSION.post(
             "https://api.regolo.ai/v1/chat/completions",
             headers={"Authorization": f"Bearer {API_KEY}"},
             json={
@@ -31,7 +45,11 @@ except ImportError:
             timeout=30,
         )
         response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        content = response.json()["choices"][0]["message"]["content"]
+
+        if key:
+            get_cache().set(key, content)
+        return content
 
 
 @tool(return_direct=True)
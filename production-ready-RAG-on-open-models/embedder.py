@@ -4,14 +4,100 @@ Uses gte-Qwen2-7B-instruct on Regolo for SOTA open-source embeddings.
 """
 
 import os
-import requests
-from typing import List, Dict
+import atexit
+import asyncio
+import threading
+import httpx
+from typing import Callable, List, Dict, Optional
 import numpy as np
 import time
 
 REGOLO_API_KEY = os.environ.get("REGOLO_API_KEY")
 BASE_URL = os.environ.get("REGOLO_BASE_URL", "https://api.regolo.ai/v1")
 EMBEDDING_MODEL = os.environ.get("EMBEDDING_MODEL", "gte-Qwen2-7B-instruct")
+EMBED_CONCURRENCY = int(os.environ.get("EMBED_CONCURRENCY", "5"))  # Batches in flight at once
+EMBED_MAX_RETRIES = 3  # Retries per batch on HTTP 429
+
+
+# One background event loop owns the pooled keep-alive client, so every call (a single
+# query, a bulk embed, or a call made from inside another event loop) reuses the same
+# connections. Both are created on first use, so the key check runs first
+_LOOP: Optional[asyncio.AbstractEventLoop] = None
+_ACLIENT: Optional[httpx.AsyncClient] = None
+_LOOP_LOCK = threading.Lock()
+
+
+def _get_loop() -> asyncio.AbstractEventLoop:
+    global _LOOP, _ACLIENT
+    with _LOOP_LOCK:
+        if _LOOP is None:
+            _ACLIENT = httpx.AsyncClient(
+                base_url=BASE_URL,
+                http2=True,
+                timeout=60,
+                headers={"Authorization": f"Bearer {REGOLO_API_KEY}"},
+                limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+            )
+            _LOOP = asyncio.new_event_loop()
+            threading.Thread(target=_LOOP.run_forever, name="embedder-loop", daemon=True).start()
+            atexit.register(_close_loop)
+    return _LOOP
+
+
+def _close_loop() -> None:
+    asyncio.run_coroutine_threadsafe(_ACLIENT.aclose(), _LOOP).result(timeout=5)
+    _LOOP.call_soon_threadsafe(_LOOP.stop)
+
+
+def _retry_after(headers, attempt: int) -> float:
+    """Seconds to wait before retrying: the Retry-After header if numeric, else exponential backoff."""
+    try:
+        return float(headers.get("Retry-After", ""))
+    except ValueError:
+        return 2 ** attempt
+
+
+async def _post_batch(batch: List[str], model: str, batch_num: int) -> List[List[float]]:
+    """Embed one batch on the pooled client, honouring Retry-After on HTTP 429."""
+    for attempt in range(EMBED_MAX_RETRIES + 1):
+        response = await _ACLIENT.post(
+            "/embeddings",
+            json={
+                "model": model,
+                "input": batch
+            }
+        )
+        if response.status_code == 429 and attempt < EMBED_MAX_RETRIES:
+            await asyncio.sleep(_retry_after(response.headers, attempt))
+            continue
+
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            print(f"Error embedding batch {batch_num}: {e}")
+            print(f"Response: {response.text}")
+            raise
+
+        data = response.json()
+        return [item["embedding"] for item in data["data"]]
+
+
+async def _embed_async(
+    batches: List[List[str]],
+    model: str,
+    store: Callable[[int, List[List[float]]], None]
+) -> None:
+    """
+    POST all batches concurrently (at most EMBED_CONCURRENCY in flight).
+    Each batch's embeddings are handed to store(batch_num, vectors) as they arrive.
+    """
+    semaphore = asyncio.Semaphore(EMBED_CONCURRENCY)
+
+    async def post_batch(batch_num: int, batch: List[str]):
+        async with semaphore:
+            store(batch_num, await _post_batch(batch, model, batch_num))
+
+    await asyncio.gather(*[post_batch(i, batch) for i, batch in enumerate(batches)])
 
 
 def embed_with_gte_qwen2(
@@ -29,7 +115,7 @@ def embed_with_gte_qwen2(
         batch_size: Number of texts per API call
 
     Returns:
-        NumPy array of shape (len(texts), embedding_dim)
+        float32 NumPy array of shape (len(texts), embedding_dim)
     """
     if not REGOLO_API_KEY:
         raise RuntimeError(
@@ -37,61 +123,57 @@ def embed_with_gte_qwen2(
             "Get your key from https://regolo.ai/dashboard"
         )
 
-    all_embeddings = []
+    batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+    out = None
 
-    # Process in batches to avoid rate limits
-    for i in range(0, len(texts), batch_size):
-        batch = texts[i:i + batch_size]
+    def store(batch_num: int, vectors: List[List[float]]):
+        # Write each batch straight into one preallocated array (dim probed from the first reply)
+        nonlocal out
+        block = np.asarray(vectors, dtype=np.float32)
+        if out is None:
+            out = np.empty((len(texts), block.shape[1]), dtype=np.float32)
+        start = batch_num * batch_size
+        out[start:start + len(block)] = block
 
-        response = requests.post(
-            f"{BASE_URL}/embeddings",
-            headers={"Authorization": f"Bearer {REGOLO_API_KEY}"},
-            json={
-                "model": model,
-                "input": batch
-            },
-            timeout=60
-        )
+    if batches:
+        # Runs on the embedder loop thread (callers just block on the result). Rate limiting
+        # is handled by the in-flight cap and Retry-After on 429, for one batch or many
+        asyncio.run_coroutine_threadsafe(_embed_async(batches, model, store), _get_loop()).result()
 
-        try:
-            response.raise_for_status()
-        except requests.HTTPError as e:
-            print(f"Error embedding batch {i//batch_size}: {e}")
-            print(f"Response: {response.text}")
-            raise
-
-        data = response.json()
-        batch_embeddings = [item["embedding"] for item in data["data"]]
-        all_embeddings.extend(batch_embeddings)
-
-        # Rate limiting: small delay between batches
-        if i + batch_size < len(texts):
-            time.sleep(0.1)
+    return out if out is not None else np.empty((0, 0), dtype=np.float32)
 
-    return np.array(all_embeddings)
 
-
-def embed_chunks(chunks: List[Dict]) -> List[Dict]:
+def embed_chunks(chunks: List[Dict], verbose: bool = True) -> List[Dict]:
     """
     Embed all chunks and attach vectors to metadata.
 
     Args:
         chunks: List of chunk dicts with 'content' key
+        verbose: Print progress (off when called per batch from a pipeline)
 
     Returns:
         Same chunks with 'embedding' key added
     """
     texts = [chunk["content"] for chunk in chunks]
 
-    print(f"Embedding {len(texts)} chunks with {EMBEDDING_MODEL}...")
+    if verbose:
+        print(f"Embedding {len(texts)} chunks with {EMBEDDING_MODEL}...")
     start = time.time()
 
     embeddings = embed_with_gte_qwen2(texts)
 
+    # Unit-normalize once at write time so the store can rank by plain dot product
+    embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    # float16 halves the memory held by chunks; recall loss on unit vectors is negligible
+    embeddings = embeddings.astype(np.float16)
+
     elapsed = time.time() - start
-    print(f"✓ Embedded {len(texts)} chunks in {elapsed:.2f}s")
-    print(f"  Embedding dimension: {embeddings.shape[1]}")
+    if verbose:
+        print(f"✓ Embedded {len(texts)} chunks in {elapsed:.2f}s")
+        print(f"  Embedding dimension: {embeddings.shape[1]}")
 
+    # Row views: chunks share memory with the embeddings array instead of holding copies
     for i, chunk in enumerate(chunks):
         chunk["embedding"] = embeddings[i]
 
@@ -3,10 +3,47 @@ Evaluation Module
 Measures retrieval and generation quality with standard metrics.
 """
 
+import re
 from typing import List, Dict
 import numpy as np
 
 
+HASH_BITS = 20  # Token hash bitmap size: 2**20 slots (1 MB)
+_HASH_MASK = (1 << HASH_BITS) - 1
+_TOKEN_RE = re.compile(r"[a-z]+")
+
+# Common words ignored when counting hallucinated tokens (stopwords approximation)
+STOPWORDS = frozenset({"the", "a", "an", "is", "are", "was", "were", "i", "you", "to", "of", "in", "on", "at"})
+
+
+def _token_hashes(text: str) -> np.ndarray:
+    """Hash each lowercase word of text into the bitmap range."""
+    return np.fromiter(
+        (hash(t) & _HASH_MASK for t in _TOKEN_RE.findall(text.lower())),
+        dtype=np.int64
+    )
+
+
+_STOP_BITS = np.zeros(1 << HASH_BITS, dtype=bool)
+_STOP_BITS[_token_hashes(" ".join(STOPWORDS))] = True
+
+
+def _incidence_matrix(doc_lists: List[List[str]], doc2id: Dict[str, int]) -> np.ndarray:
+    """Boolean (len(doc_lists) x len(doc2id)) matrix; row q marks the docs in doc_lists[q]."""
+    matrix = np.zeros((len(doc_lists), len(doc2id)), dtype=bool)
+    rows = np.repeat(np.arange(len(doc_lists)), [len(docs) for docs in doc_lists])
+    cols = np.fromiter((doc2id[d] for docs in doc_lists for d in docs), dtype=np.int32, count=len(rows))
+    matrix[rows, cols] = True
+    return matrix
+
+
+def _f1(precision, recall):
+    """Harmonic mean of precision and recall (scalars or arrays), 0 where both are 0."""
+    precision, recall = np.asarray(precision, dtype=float), np.asarray(recall, dtype=float)
+    denom = precision + recall
+    return np.divide(2 * precision * recall, denom, out=np.zeros_like(denom), where=denom > 0)
+
+
 def evaluate_retrieval(
     queries: List[str],
     retrieved: List[List[str]],
@@ -21,43 +58,85 @@ def evaluate_retrieval(
         ground_truth: List of relevant doc lists per query
 
     Returns:
-        Dict with precision@k, recall@k, f1@k
+        Dict with precision@k, recall@k, f1@k (of the averages)
+        and f1_macro@k (average of per-query F1)
     """
     if len(retrieved) != len(ground_truth):
         raise ValueError("Retrieved and ground_truth must have same length")
 
-    precisions = []
-    recalls = []
-
-    for ret, truth in zip(retrieved, ground_truth):
-        # Convert to sets for intersection
-        ret_set = set(ret)
-        truth_set = set(truth)
+    # Encode doc ids once, then build boolean (queries x docs) incidence matrices
+    doc2id = {d: i for i, d in enumerate(sorted({d for docs in retrieved + ground_truth for d in docs}))}
+    R = _incidence_matrix(retrieved, doc2id)
+    G = _incidence_matrix(ground_truth, doc2id)
 
-        relevant_retrieved = ret_set & truth_set
+    # Relevant retrieved per query in one vectorized pass
+    tp = (R & G).sum(axis=1)
+    ret_lens = np.array([len(ret) for ret in retrieved])
+    truth_lens = np.array([len(truth) for truth in ground_truth])
 
-        precision = len(relevant_retrieved) / len(ret) if ret else 0
-        recall = len(relevant_retrieved) / len(truth) if truth else 0
-
-        precisions.append(precision)
-        recalls.append(recall)
+    precisions = tp / ret_lens.clip(min=1)
+    recalls = tp / truth_lens.clip(min=1)
 
     avg_precision = np.mean(precisions)
     avg_recall = np.mean(recalls)
 
-    # F1 score
-    if avg_precision + avg_recall > 0:
-        f1 = 2 * avg_precision * avg_recall / (avg_precision + avg_recall)
-    else:
-        f1 = 0.0
+    # F1 scores, branchless: 0 wherever precision + recall is 0
+    f1 = _f1(avg_precision, avg_recall)
+    f1_per_query = _f1(precisions, recalls)
 
     return {
         "precision@k": round(avg_precision, 3),
         "recall@k": round(avg_recall, 3),
-        "f1@k": round(f1, 3)
+        "f1@k": round(float(f1), 3),
+        "f1_macro@k": round(np.mean(f1_per_query), 3)
     }
 
 
+def _answer_token_sets(answers: List[str]) -> List[np.ndarray]:
+    """Unique token hashes per answer (tokenized once, shared by all answer metrics)."""
+    return [np.unique(_token_hashes(a)) for a in answers]
+
+
+def _relevancy_scores(answer_sets: List[np.ndarray], ground_truth_answers: List[str]) -> List[float]:
+    scores = []
+
+    for ans_tokens, truth in zip(answer_sets, ground_truth_answers):
+        # Simplified: token overlap
+        truth_tokens = np.unique(_token_hashes(truth))
+
+        overlap = len(np.intersect1d(ans_tokens, truth_tokens, assume_unique=True))
+        score = overlap / max(len(truth_tokens), 1)
+
+        scores.append(min(score, 1.0))
+
+    return scores
+
+
+def _hallucination_scores(answer_sets: List[np.ndarray], contexts: List[List[str]]) -> List[float]:
+    hallucination_scores = []
+    context_bits = np.zeros(1 << HASH_BITS, dtype=bool)  # Reused across pairs
+
+    for answer_hashes, context_list in zip(answer_sets, contexts):
+        # Mark all context tokens in the bitmap
+        context_hashes = _token_hashes(" ".join(context_list))
+        context_bits[context_hashes] = True
+
+        # Tokens in answer but not in context, ignoring stopwords
+        hallucinated = (~context_bits[answer_hashes] & ~_STOP_BITS[answer_hashes]).sum()
+
+        # Clear only the bits we set, ready for the next pair
+        context_bits[context_hashes] = False
+
+        if len(answer_hashes) > 0:
+            hallucination_score = hallucinated / len(answer_hashes)
+        else:
+            hallucination_score = 0.0
+
+        hallucination_scores.append(hallucination_score)
+
+    return hallucination_scores
+
+
 def evaluate_generation(
     answers: List[str],
     ground_truth_answers: List[str]
@@ -73,17 +152,7 @@ def evaluate_generation(
     Returns:
         Dict with answer_relevancy score
     """
-    scores = []
-
-    for ans, truth in zip(answers, ground_truth_answers):
-        # Simplified: token overlap
-        ans_tokens = set(ans.lower().split())
-        truth_tokens = set(truth.lower().split())
-
-        overlap = len(ans_tokens & truth_tokens)
-        score = overlap / max(len(truth_tokens), 1)
-
-        scores.append(min(score, 1.0))
+    scores = _relevancy_scores(_answer_token_sets(answers), ground_truth_answers)
 
     return {
         "answer_relevancy": round(np.mean(scores), 3)
@@ -105,30 +174,27 @@ def calculate_hallucination_rate(
     Returns:
         Hallucination rate (0.0 to 1.0)
     """
-    hallucination_scores = []
+    return round(np.mean(_hallucination_scores(_answer_token_sets(answers), contexts)), 3)
 
-    for answer, context_list in zip(answers, contexts):
-        answer_tokens = set(answer.lower().split())
 
-        # Combine all context
-        context_text = " ".join(context_list).lower()
-        context_tokens = set(context_text.split())
-
-        # Tokens in answer but not in context
-        hallucinated = answer_tokens - context_tokens
-
-        # Remove common words (stopwords approximation)
-        common_words = {"the", "a", "an", "is", "are", "was", "were", "i", "you", "to", "of", "in", "on", "at"}
-        hallucinated = hallucinated - common_words
-
-        if len(answer_tokens) > 0:
-            hallucination_score = len(hallucinated) / len(answer_tokens)
-        else:
-            hallucination_score = 0.0
+def evaluate_all(
+    answers: List[str],
+    ground_truth_answers: List[str],
+    contexts: List[List[str]]
+) -> Dict[str, float]:
+    """
+    evaluate_generation + calculate_hallucination_rate in one pass,
+    tokenizing each answer only once.
 
-        hallucination_scores.append(hallucination_score)
+    Returns:
+        Dict with answer_relevancy and hallucination_rate
+    """
+    answer_sets = _answer_token_sets(answers)
 
-    return round(np.mean(hallucination_scores), 3)
+    return {
+        "answer_relevancy": round(np.mean(_relevancy_scores(answer_sets, ground_truth_answers)), 3),
+        "hallucination_rate": round(np.mean(_hallucination_scores(answer_sets, contexts)), 3)
+    }
 
 
 if __name__ == "__main__":
@@ -4,42 +4,74 @@ Uses Llama-3.3-70B-Instruct on Regolo with strict prompting.
 """
 
 import os
-import requests
-from typing import List
+import json
+import atexit
+import asyncio
+import httpx
+from typing import AsyncIterator, Dict, Iterator, List, Optional, Tuple
 
 REGOLO_API_KEY = os.environ.get("REGOLO_API_KEY")
 BASE_URL = os.environ.get("REGOLO_BASE_URL", "https://api.regolo.ai/v1")
 LLM_MODEL = os.environ.get("LLM_MODEL", "Llama-3.3-70B-Instruct")
 
 
-def rag_generate(
-    query: str,
-    retrieved_docs: List[str],
-    temperature: float = 0.1,
-    max_tokens: int = 500
-) -> str:
-    """
-    Generate answer using Llama-3.3-70B-Instruct on Regolo.
-    Uses strict prompt to reduce hallucination to <10%.
+# Pooled keep-alive client, created on first use so the key check runs first
+_CLIENT: Optional[httpx.Client] = None
 
-    Args:
-        query: User question
-        retrieved_docs: List of relevant document chunks
-        temperature: Sampling temperature (low = factual)
-        max_tokens: Maximum response length
 
-    Returns:
-        Generated answer text
+def _get_client() -> httpx.Client:
+    global _CLIENT
+    if _CLIENT is None:
+        _CLIENT = httpx.Client(
+            base_url=BASE_URL,
+            http2=True,
+            timeout=60,
+            headers={"Authorization": f"Bearer {REGOLO_API_KEY}"},
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
+        )
+        atexit.register(_CLIENT.close)
+    return _CLIENT
+
+
+# Async clients for concurrent calls, one per event loop (asyncio.run creates a new loop,
+# and connections belong to the loop that opened them)
+_ACLIENTS: Dict[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, asyncio.Task]] = {}
+
+
+async def _close_at_shutdown(loop: asyncio.AbstractEventLoop, client: httpx.AsyncClient) -> None:
     """
-    if not REGOLO_API_KEY:
-        raise RuntimeError(
-            "REGOLO_API_KEY not set. "
-            "Get your key from https://regolo.ai/dashboard"
+    Park until the loop cancels its leftover tasks on shutdown (asyncio.run does),
+    then close the client inside the loop that owns its connections.
+    """
+    try:
+        await loop.create_future()
+    finally:
+        _ACLIENTS.pop(loop, None)
+        await client.aclose()
+
+
+def _get_aclient() -> httpx.AsyncClient:
+    loop = asyncio.get_running_loop()
+    entry = _ACLIENTS.get(loop)
+    if entry is None:
+        client = httpx.AsyncClient(
+            base_url=BASE_URL,
+            http2=True,
+            timeout=60,
+            headers={"Authorization": f"Bearer {REGOLO_API_KEY}"},
+            limits=httpx.Limits(max_keepalive_connections=20, max_connections=40),
         )
+        entry = _ACLIENTS[loop] = (client, loop.create_task(_close_at_shutdown(loop, client)))
+    return entry[0]
 
-    if not retrieved_docs:
-        return "No relevant context found to answer this question."
 
+def _build_payload(
+    query: str,
+    retrieved_docs: List[str],
+    temperature: float,
+    max_tokens: int
+) -> dict:
+    """Chat completion request body with the strict RAG prompt."""
     # Format context with numbered references
     context = "\n\n".join([
         f"[{i+1}] {doc}"
@@ -58,40 +90,209 @@ Question: {query}
 
 Answer:"""
 
-    response = requests.post(
-        f"{BASE_URL}/chat/completions",
-        headers={"Authorization": f"Bearer {REGOLO_API_KEY}"},
-        json={
-            "model": LLM_MODEL,
-            "temperature": temperature,
-            "max_tokens": max_tokens,
-            "messages": [
-                {
-                    "role": "system",
-                    "content": "You are a precise assistant that answers only based on provided context."
-                },
-                {
-                    "role": "user",
-                    "content": prompt
-                }
-            ]
-        },
-        timeout=60
+    return {
+        "model": LLM_MODEL,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "messages": [
+            {
+                "role": "system",
+                "content": "You are a precise assistant that answers only based on provided context."
+            },
+            {
+                "role": "user",
+                "content": prompt
+            }
+        ]
+    }
+
+
+_SSE_DONE = object()  # End-of-stream marker returned by _parse_sse_line
+
+
+def _parse_sse_line(line: str):
+    """
+    Delta text carried by one Server-Sent Events line, None if it carries none
+    (keep-alives, comments, role or usage-only chunks), or _SSE_DONE at [DONE].
+    """
+    if not line.startswith("data:"):
+        return None
+    data = line[len("data:"):].strip()
+    if data == "[DONE]":
+        return _SSE_DONE
+    chunk = json.loads(data)
+    if not chunk.get("choices"):
+        return None
+    return chunk["choices"][0].get("delta", {}).get("content")
+
+
+def _check_key():
+    if not REGOLO_API_KEY:
+        raise RuntimeError(
+            "REGOLO_API_KEY not set. "
+            "Get your key from https://regolo.ai/dashboard"
+        )
+
+
+def _generate(
+    query: str,
+    retrieved_docs: List[str],
+    temperature: float = 0.1,
+    max_tokens: int = 500
+) -> Tuple[str, Optional[dict]]:
+    """Answer text and the API's token usage (None if no request was made or none reported)."""
+    _check_key()
+
+    if not retrieved_docs:
+        return "No relevant context found to answer this question.", None
+
+    response = _get_client().post(
+        "/chat/completions",
+        json=_build_payload(query, retrieved_docs, temperature, max_tokens)
     )
 
     try:
         response.raise_for_status()
-    except requests.HTTPError as e:
+    except httpx.HTTPStatusError as e:
         print(f"Error generating answer: {e}")
         print(f"Response: {response.text}")
         raise
 
     data = response.json()
-    answer = data["choices"][0]["message"]["content"]
+    return data["choices"][0]["message"]["content"], data.get("usage")
 
+
+def rag_generate(
+    query: str,
+    retrieved_docs: List[str],
+    temperature: float = 0.1,
+    max_tokens: int = 500
+) -> str:
+    """
+    Generate answer using Llama-3.3-70B-Instruct on Regolo.
+    Uses strict prompt to reduce hallucination to <10%.
+
+    Args:
+        query: User question
+        retrieved_docs: List of relevant document chunks
+        temperature: Sampling temperature (low = factual)
+        max_tokens: Maximum response length
+
+    Returns:
+        Generated answer text
+    """
+    answer, _ = _generate(query, retrieved_docs, temperature, max_tokens)
     return answer
 
 
+async def rag_generate_async(
+    query: str,
+    retrieved_docs: List[str],
+    temperature: float = 0.1,
+    max_tokens: int = 500,
+    client: Optional[httpx.AsyncClient] = None
+) -> str:
+    """
+    Async version of rag_generate: the request runs as a coroutine,
+    so many answers can be in flight without tying up threads.
+
+    Args:
+        client: AsyncClient to use (default: shared client for the running loop)
+    """
+    _check_key()
+
+    if not retrieved_docs:
+        return "No relevant context found to answer this question."
+
+    client = client or _get_aclient()
+    response = await client.post(
+        "/chat/completions",
+        json=_build_payload(query, retrieved_docs, temperature, max_tokens)
+    )
+
+    try:
+        response.raise_for_status()
+    except httpx.HTTPStatusError as e:
+        print(f"Error generating answer: {e}")
+        print(f"Response: {response.text}")
+        raise
+
+    data = response.json()
+    return data["choices"][0]["message"]["content"]
+
+
+def rag_generate_stream(
+    query: str,
+    retrieved_docs: List[str],
+    temperature: float = 0.1,
+    max_tokens: int = 500
+) -> Iterator[str]:
+    """
+    Streaming version of rag_generate: yields answer text as it is generated,
+    so the first words arrive after prefill instead of after the full answer.
+    """
+    _check_key()
+
+    if not retrieved_docs:
+        yield "No relevant context found to answer this question."
+        return
+
+    payload = _build_payload(query, retrieved_docs, temperature, max_tokens)
+    payload["stream"] = True
+
+    with _get_client().stream("POST", "/chat/completions", json=payload) as response:
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            print(f"Error generating answer: {e}")
+            print(f"Response: {response.read().decode(errors='replace')}")
+            raise
+
+        for line in response.iter_lines():
+            content = _parse_sse_line(line)
+            if content is _SSE_DONE:
+                break
+            if content:
+                yield content
+
+
+async def rag_generate_stream_async(
+    query: str,
+    retrieved_docs: List[str],
+    temperature: float = 0.1,
+    max_tokens: int = 500,
+    client: Optional[httpx.AsyncClient] = None
+) -> AsyncIterator[str]:
+    """
+    Async variant of rag_generate_stream for use from async code.
+    Yields answer text as it arrives.
+    """
+    _check_key()
+
+    if not retrieved_docs:
+        yield "No relevant context found to answer this question."
+        return
+
+    payload = _build_payload(query, retrieved_docs, temperature, max_tokens)
+    payload["stream"] = True
+
+    client = client or _get_aclient()
+    async with client.stream("POST", "/chat/completions", json=payload) as response:
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError as e:
+            print(f"Error generating answer: {e}")
+            print(f"Response: {(await response.aread()).decode(errors='replace')}")
+            raise
+
+        async for line in response.aiter_lines():
+            content = _parse_sse_line(line)
+            if content is _SSE_DONE:
+                break
+            if content:
+                yield content
+
+
 def rag_generate_with_metadata(
     query: str,
     retrieved_docs: List[str],
@@ -103,17 +304,20 @@ def rag_generate_with_metadata(
     Returns:
         Dict with 'answer', 'tokens', 'cost_usd'
     """
-    answer = rag_generate(query, retrieved_docs, **kwargs)
+    answer, usage = _generate(query, retrieved_docs, **kwargs)
 
-    # Rough token count (1 token ≈ 4 chars)
-    total_chars = len(query) + sum(len(d) for d in retrieved_docs) + len(answer)
-    estimated_tokens = total_chars // 4
+    if usage and "prompt_tokens" in usage and "completion_tokens" in usage:
+        # Real counts from the API (prompt includes the system message and template)
+        input_tokens = usage["prompt_tokens"]
+        output_tokens = usage["completion_tokens"]
+    else:
+        # Rough token count (1 token ≈ 4 chars), one pass over the inputs
+        input_tokens = (len(query) + sum(len(d) for d in retrieved_docs)) // 4
+        output_tokens = len(answer) // 4
+    estimated_tokens = input_tokens + output_tokens
 
     # Llama-3.3-70B pricing on Regolo (example)
     # Input: $0.30 / 1M tokens, Output: $0.60 / 1M tokens
-    input_tokens = (len(query) + sum(len(d) for d in retrieved_docs)) // 4
-    output_tokens = len(answer) // 4
-
     cost_usd = (input_tokens * 0.30 / 1_000_000) + (output_tokens * 0.60 / 1_000_000)
 
     return {
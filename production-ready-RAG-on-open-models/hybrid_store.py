@@ -4,11 +4,53 @@ Combines ChromaDB (dense) with BM25 (lexical) for better retrieval.
 """
 
 import chromadb
-from rank_bm25 import BM25Okapi
-import pickle
+import asyncio
+import json
 import os
-from typing import List, Dict
+import re
+from collections import Counter
+from functools import lru_cache
+from typing import List, Dict, Tuple
 import numpy as np
+import scipy.sparse
+
+# BM25Okapi parameters (same defaults as rank_bm25)
+BM25_K1 = 1.5
+BM25_B = 0.75
+BM25_EPSILON = 0.25  # Floor for negative IDF, as a fraction of the mean IDF
+
+CHROMA_ADD_BATCH = 500  # Chunks per collection.add call
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+
+def _tokenize(text: str) -> List[str]:
+    """Lowercase alphanumeric words (punctuation splits tokens, unlike str.split)."""
+    return _TOKEN_RE.findall(text.lower())
+
+
+@lru_cache(maxsize=1024)
+def _tokenize_query(query: str) -> Tuple[str, ...]:
+    """Query tokens, cached so repeated queries skip the regex pass."""
+    return tuple(_tokenize(query))
+
+
+def _bm25_weights(
+    tf: scipy.sparse.csr_matrix,
+    idf: np.ndarray,
+    doc_len: np.ndarray,
+    avgdl: float
+) -> scipy.sparse.csc_matrix:
+    """
+    Precompute the BM25 weight of every (doc, term) pair, so a query's scores
+    are just a sum of the weight columns of its terms.
+    """
+    weights = tf.astype(np.float32, copy=True)
+    rows = np.repeat(np.arange(tf.shape[0]), np.diff(tf.indptr))
+    freq = weights.data
+    norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_len[rows] / avgdl)
+    weights.data = (idf[weights.indices] * freq * (BM25_K1 + 1) / (freq + norm)).astype(np.float32)
+    return weights.tocsc()
 
 
 class HybridStore:
@@ -29,11 +71,15 @@ class HybridStore:
         self.client = chromadb.PersistentClient(path=persist_path)
         self.collection = self.client.get_or_create_collection(
             name="docs",
-            metadata={"hnsw:space": "cosine"}
+            # Embeddings are unit-normalized, so inner product ranks like cosine
+            # without renormalizing each visited vector
+            metadata={"hnsw:space": "ip"}
         )
-        self.bm25 = None
+        self.bm25 = None  # (docs x terms) BM25 weight matrix
+        self.vocab = {}
         self.documents = []
-        self.bm25_path = os.path.join(persist_path, "bm25_index.pkl")
+        self.bm25_path = os.path.join(persist_path, "bm25_index.npz")
+        self.bm25_meta_path = os.path.join(persist_path, "bm25_meta.json")
 
     def index(self, chunks: List[Dict]):
         """
@@ -47,63 +93,132 @@ class HybridStore:
 
         print(f"Indexing {len(chunks)} chunks...")
 
-        ids = [f"doc_{i}" for i in range(len(chunks))]
-        contents = [c["content"] for c in chunks]
-        embeddings = [c["embedding"].tolist() for c in chunks]
-        metadatas = [c["metadata"] for c in chunks]
-
-        # Add to ChromaDB (dense vector search)
-        self.collection.add(
-            embeddings=embeddings,
-            documents=contents,
-            metadatas=metadatas,
-            ids=ids
-        )
-
+        self.add_dense(chunks)
         print(f"  ✓ Indexed in ChromaDB (dense)")
 
-        # Build BM25 index (lexical keyword search)
-        self.documents = contents
-        tokenized = [doc.lower().split() for doc in contents]
-        self.bm25 = BM25Okapi(tokenized)
-
-        # Save BM25 for persistence
-        with open(self.bm25_path, "wb") as f:
-            pickle.dump((self.bm25, self.documents), f)
-
+        self.build_lexical([c["content"] for c in chunks])
         print(f"  ✓ Indexed in BM25 (lexical)")
         print(f"\n✓ Hybrid index built successfully")
 
+    def add_dense(self, chunks: List[Dict], start: int = 0):
+        """
+        Add embedded chunks to ChromaDB (dense vector search), CHROMA_ADD_BATCH at a time
+        so large corpora don't build one giant float32 matrix and HNSW insert.
+
+        Args:
+            chunks: List of chunk dicts with 'content', 'embedding', 'metadata'
+            start: Position of the first chunk in the whole index (for ids)
+        """
+        for offset in range(0, len(chunks), CHROMA_ADD_BATCH):
+            batch = chunks[offset:offset + CHROMA_ADD_BATCH]
+            first = start + offset
+            # Chroma stores float32: upcast the (float16) vectors in one pass and
+            # hand over the matrix as-is, no per-float Python list round-trip
+            embeddings = np.stack([c["embedding"] for c in batch]).astype(np.float32)
+
+            self.collection.add(
+                embeddings=embeddings,
+                documents=[c["content"] for c in batch],
+                metadatas=[c["metadata"] for c in batch],
+                ids=[f"doc_{i}" for i in range(first, first + len(batch))]
+            )
+
+    def build_lexical(self, contents: List[str]):
+        """
+        Build and persist the BM25 index (lexical keyword search) over all chunk texts.
+
+        Args:
+            contents: Chunk texts, in index order
+        """
+        # Sparse term frequencies + IDF
+        self.documents = contents
+        self.vocab = {}
+        indptr, indices, counts, doc_len = [0], [], [], []
+        for doc in contents:
+            tokens = _tokenize(doc)
+            for term, count in Counter(tokens).items():
+                indices.append(self.vocab.setdefault(term, len(self.vocab)))
+                counts.append(count)
+            indptr.append(len(indices))
+            doc_len.append(len(tokens))
+
+        tf = scipy.sparse.csr_matrix(
+            (np.array(counts, dtype=np.float32), np.array(indices, dtype=np.int32), np.array(indptr)),
+            shape=(len(contents), len(self.vocab))
+        )
+        doc_len = np.array(doc_len, dtype=np.float32)
+        avgdl = float(doc_len.mean())
+
+        df = np.bincount(tf.indices, minlength=len(self.vocab))
+        idf = np.log(len(contents) - df + 0.5) - np.log(df + 0.5)
+        idf[idf < 0] = BM25_EPSILON * idf.mean()
+
+        # Save BM25 for persistence (arrays in npz, vocab and texts in JSON)
+        np.savez_compressed(
+            self.bm25_path,
+            tf_data=tf.data, tf_indices=tf.indices, tf_indptr=tf.indptr, tf_shape=np.array(tf.shape),
+            idf=idf, doc_len=doc_len, avgdl=np.array(avgdl)
+        )
+        with open(self.bm25_meta_path, "w", encoding="utf-8") as f:
+            json.dump({"vocab": self.vocab, "documents": self.documents}, f)
+
+        self.bm25 = _bm25_weights(tf, idf, doc_len, avgdl)
+
     def load_bm25(self):
         """Load BM25 index from disk."""
-        if not os.path.exists(self.bm25_path):
+        if not (os.path.exists(self.bm25_path) and os.path.exists(self.bm25_meta_path)):
             raise FileNotFoundError(
                 f"BM25 index not found at {self.bm25_path}. "
                 "Run index() first."
             )
 
-        with open(self.bm25_path, "rb") as f:
-            self.bm25, self.documents = pickle.load(f)
+        with np.load(self.bm25_path) as data:
+            tf = scipy.sparse.csr_matrix(
+                (data["tf_data"], data["tf_indices"], data["tf_indptr"]),
+                shape=tuple(data["tf_shape"])
+            )
+            self.bm25 = _bm25_weights(tf, data["idf"], data["doc_len"], float(data["avgdl"]))
+
+        with open(self.bm25_meta_path, encoding="utf-8") as f:
+            meta = json.load(f)
+        self.vocab, self.documents = meta["vocab"], meta["documents"]
 
         print(f"✓ Loaded BM25 index with {len(self.documents)} documents")
 
-    def dense_search(self, query_embedding: np.ndarray, top_k: int = 10) -> List[str]:
+    def dense_search(self, query_embedding: np.ndarray, top_k: int = 10, normalized: bool = False) -> List[str]:
         """
         Dense vector search using ChromaDB.
 
         Args:
-            query_embedding: Query vector
+            query_embedding: Query vector (normalized here to match the index)
             top_k: Number of results
+            normalized: query_embedding is already a unit float32 vector, skip normalizing
 
         Returns:
             List of document texts
         """
+        if not normalized:
+            query_embedding = np.asarray(query_embedding, dtype=np.float32)
+            query_embedding = query_embedding / max(np.linalg.norm(query_embedding), 1e-12)
         results = self.collection.query(
             query_embeddings=[query_embedding.tolist()],
             n_results=top_k
         )
         return results["documents"][0] if results["documents"] else []
 
+    async def dense_search_async(
+        self,
+        query_embedding: np.ndarray,
+        top_k: int = 10,
+        normalized: bool = False
+    ) -> List[str]:
+        """dense_search in a worker thread, for use with asyncio.gather."""
+        return await asyncio.to_thread(self.dense_search, query_embedding, top_k, normalized)
+
+    async def lexical_search_async(self, query: str, top_k: int = 10) -> List[str]:
+        """lexical_search in a worker thread, for use with asyncio.gather."""
+        return await asyncio.to_thread(self.lexical_search, query, top_k)
+
     def lexical_search(self, query: str, top_k: int = 10) -> List[str]:
         """
         Lexical BM25 search.
@@ -118,11 +233,20 @@ class HybridStore:
         if self.bm25 is None:
             self.load_bm25()
 
-        tokenized_query = query.lower().split()
-        bm25_scores = self.bm25.get_scores(tokenized_query)
-
-        # Get top-K indices
-        top_indices = np.argsort(bm25_scores)[-top_k:][::-1]
+        # Sum the weight columns of the query terms (repeated terms count repeatedly)
+        term_ids = [self.vocab[t] for t in _tokenize_query(query) if t in self.vocab]
+        if term_ids:
+            terms, counts = np.unique(term_ids, return_counts=True)
+            bm25_scores = self.bm25[:, terms] @ counts.astype(np.float32)
+        else:
+            bm25_scores = np.zeros(len(self.documents), dtype=np.float32)
+
+        # Get top-K indices: O(N) selection, then sort only those K
+        k = min(top_k, len(bm25_scores))
+        if k <= 0:
+            return []
+        idx = np.argpartition(bm25_scores, -k)[-k:]
+        top_indices = idx[np.argsort(bm25_scores[idx])[::-1]]
 
         return [self.documents[i] for i in top_indices]
 
@@ -5,12 +5,17 @@ Complete end-to-end production RAG system.
 
 import os
 import asyncio
+import time
 from typing import List
 from semantic_chunker import semantic_chunk
-from embedder import embed_chunks
+from embedder import embed_chunks, EMBED_CONCURRENCY
 from hybrid_store import HybridStore
 from retriever import HybridRetriever
-from production_rag import cached_rag
+from production_rag import cached_rag, cached_rag_stream, cached_embed_query
+
+EMBED_BATCH = 32   # Chunks per embedding request
+INDEX_BATCH = 256  # Chunks per ChromaDB add
+QUEUE_SIZE = 4     # Batches buffered between stages
 
 
 def load_sample_documents() -> List[str]:
@@ -78,6 +83,79 @@ prompted with retrieved context.
     """]
 
 
+async def chunk_embed_index(documents: List[str], store: HybridStore) -> int:
+    """
+    Chunk, embed and index as three overlapping stages joined by bounded queues,
+    so chunking CPU work runs while embedding requests are in flight.
+
+    Args:
+        documents: Document texts
+        store: HybridStore to fill
+
+    Returns:
+        Number of chunks indexed
+    """
+    to_embed = asyncio.Queue(maxsize=QUEUE_SIZE)
+    to_index = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    async def producer():
+        # Chunk one document at a time off the event loop, emit fixed-size batches
+        pending = []
+        for i, doc in enumerate(documents):
+            pending.extend(await asyncio.to_thread(
+                semantic_chunk, doc, chunk_size=800, overlap=100, doc_id=f"doc_{i}"
+            ))
+            while len(pending) >= EMBED_BATCH:
+                await to_embed.put(pending[:EMBED_BATCH])
+                pending = pending[EMBED_BATCH:]
+        if pending:
+            await to_embed.put(pending)
+        for _ in range(EMBED_CONCURRENCY):
+            await to_embed.put(None)
+
+    async def embed_worker():
+        while (batch := await to_embed.get()) is not None:
+            await to_index.put(await asyncio.to_thread(embed_chunks, batch, False))
+
+    async def embed_stage():
+        # Cancelling this stage cancels every worker; the indexer stops once all are done
+        await asyncio.gather(*[embed_worker() for _ in range(EMBED_CONCURRENCY)])
+        await to_index.put(None)
+
+    async def indexer():
+        # Dense vectors go to ChromaDB in large batches; BM25 needs the full corpus
+        pending, contents = [], []
+        while True:
+            batch = await to_index.get()
+            if batch is not None:
+                pending.extend(batch)
+            if pending and (batch is None or len(pending) >= INDEX_BATCH):
+                await asyncio.to_thread(store.add_dense, pending, len(contents))
+                contents.extend(c["content"] for c in pending)
+                pending = []
+            if batch is None:
+                break
+
+        if not contents:
+            raise ValueError("No chunks to index")
+        await asyncio.to_thread(store.build_lexical, contents)
+        return len(contents)
+
+    # A failing stage would leave the others blocked on a full queue: stop at the
+    # first exception, cancel the remaining stages and re-raise
+    stages = [asyncio.create_task(stage()) for stage in (producer, embed_stage, indexer)]
+    try:
+        done, _ = await asyncio.wait(stages, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            if not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+        return stages[-1].result()
+    finally:
+        for task in stages:
+            task.cancel()
+        await asyncio.gather(*stages, return_exceptions=True)
+
+
 async def build_rag_pipeline():
     """
     Build and test complete RAG pipeline.
@@ -87,32 +165,22 @@ async def build_rag_pipeline():
     print("=" * 60)
 
     # 1. Load documents
-    print("\n[1/6] Loading documents...")
+    print("\n[1/4] Loading documents...")
     documents = load_sample_documents()
 
-    # 2. Semantic chunking
-    print("\n[2/6] Semantic chunking...")
-    all_chunks = []
-    for i, doc in enumerate(documents):
-        chunks = semantic_chunk(doc, chunk_size=800, overlap=100, doc_id=f"doc_{i}")
-        all_chunks.extend(chunks)
-    print(f"✓ Created {len(all_chunks)} chunks")
-
-    # 3. Embed with gte-Qwen2
-    print("\n[3/6] Embedding with gte-Qwen2...")
-    all_chunks = embed_chunks(all_chunks)
-
-    # 4. Index in hybrid store
-    print("\n[4/6] Building hybrid index...")
+    # 2. Semantic chunking -> gte-Qwen2 embedding -> hybrid index, pipelined
+    print("\n[2/4] Chunking, embedding with gte-Qwen2 and building hybrid index...")
     store = HybridStore(persist_path="./rag_index")
-    store.index(all_chunks)
+    start = time.time()
+    num_chunks = await chunk_embed_index(documents, store)
+    print(f"✓ Indexed {len(documents)} documents as {num_chunks} chunks in {time.time() - start:.2f}s")
 
-    # 5. Create retriever
-    print("\n[5/6] Initializing retriever...")
-    retriever = HybridRetriever(store)
+    # 3. Create retriever
+    print("\n[3/4] Initializing retriever...")
+    retriever = HybridRetriever(store, embed_fn=cached_embed_query)
 
-    # 6. Test queries
-    print("\n[6/6] Testing queries...")
+    # 4. Test queries
+    print("\n[4/4] Testing queries...")
     test_queries = [
         "What is production-ready RAG?",
         "How does semantic chunking work?",
@@ -170,8 +238,11 @@ async def interactive_mode(retriever: HybridRetriever):
             continue
 
         try:
-            answer = await cached_rag(query, retriever)
-            print(f"\n💡 Answer: {answer}\n")
+            # Stream tokens as they arrive: perceived latency is time to first token
+            print("\n💡 Answer: ", end="", flush=True)
+            async for token in cached_rag_stream(query, retriever):
+                print(token, end="", flush=True)
+            print("\n")
         except Exception as e:
             print(f"\n❌ Error: {e}\n")
 
@@ -4,12 +4,18 @@ Adds Redis caching and async batching for 10k+ QPS.
 """
 
 import os
+import base64
 import asyncio
 import hashlib
+import httpx
+import numpy as np
 import redis
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional
 from retriever import HybridRetriever
-from generator import rag_generate
+from embedder import embed_query, EMBEDDING_MODEL
+from generator import rag_generate_async, rag_generate_stream_async
+
+EMBED_CACHE_TTL = int(os.environ.get("EMBED_CACHE_TTL", "86400"))  # Embeddings are deterministic
 
 
 # Redis client for caching
@@ -28,11 +34,44 @@ except (redis.ConnectionError, redis.ResponseError):
     rdb = None
 
 
+def _cache_key(query: str) -> str:
+    # Non-cryptographic use: a 64-bit BLAKE2b digest is faster than truncated SHA-256
+    return f"rag:{hashlib.blake2b(query.encode(), digest_size=8).hexdigest()}"
+
+
+def _embed_cache_key(query: str) -> str:
+    # Model in the key so switching EMBEDDING_MODEL never serves stale vectors
+    digest = hashlib.blake2b(f"{EMBEDDING_MODEL}\0{query}".encode(), digest_size=8).hexdigest()
+    return f"emb:{digest}"
+
+
+def cached_embed_query(query: str, ttl: int = EMBED_CACHE_TTL) -> np.ndarray:
+    """
+    embed_query with a Redis cache (float16, base64) in front of it.
+    Pass as HybridRetriever(store, embed_fn=cached_embed_query).
+
+    Returns:
+        1D float32 NumPy array
+    """
+    if not (REDIS_AVAILABLE and rdb):
+        return embed_query(query)
+
+    key = _embed_cache_key(query)
+    cached = rdb.get(key)
+    if cached:
+        return np.frombuffer(base64.b64decode(cached), dtype=np.float16).astype(np.float32)
+
+    embedding = embed_query(query)
+    rdb.setex(key, ttl, base64.b64encode(embedding.astype(np.float16).tobytes()).decode("ascii"))
+    return embedding
+
+
 async def cached_rag(
     query: str,
     retriever: HybridRetriever,
     ttl: int = 3600,
-    use_cache: bool = True
+    use_cache: bool = True,
+    client: Optional[httpx.AsyncClient] = None
 ) -> str:
     """
     RAG with Redis caching for 90%+ cache hit rate.
@@ -42,12 +81,13 @@ async def cached_rag(
         retriever: HybridRetriever instance
         ttl: Cache TTL in seconds
         use_cache: Enable/disable caching
+        client: AsyncClient for the LLM call (default: shared client)
 
     Returns:
         Generated answer
     """
     # Generate cache key
-    cache_key = f"rag:{hashlib.sha256(query.encode()).hexdigest()[:16]}"
+    cache_key = _cache_key(query)
 
     # Check cache
     if use_cache and REDIS_AVAILABLE and rdb:
@@ -55,9 +95,9 @@ async def cached_rag(
         if cached:
             return cached
 
-    # Retrieve and generate
-    retrieved = await asyncio.to_thread(retriever.retrieve, query, top_k=5)
-    answer = rag_generate(query, retrieved)
+    # Retrieve (dense + lexical concurrently, off the event loop) and generate (non-blocking HTTP)
+    retrieved = await retriever.aretrieve(query, top_k=5)
+    answer = await rag_generate_async(query, retrieved, client=client)
 
     # Store in cache
     if use_cache and REDIS_AVAILABLE and rdb:
@@ -66,34 +106,80 @@ async def cached_rag(
     return answer
 
 
+async def cached_rag_stream(
+    query: str,
+    retriever: HybridRetriever,
+    ttl: int = 3600,
+    use_cache: bool = True,
+    client: Optional[httpx.AsyncClient] = None
+) -> AsyncIterator[str]:
+    """
+    Streaming cached_rag: yields the answer as it is generated.
+    A cache hit yields the stored answer at once; a miss caches the full text at the end.
+    """
+    cache_key = _cache_key(query)
+
+    if use_cache and REDIS_AVAILABLE and rdb:
+        cached = rdb.get(cache_key)
+        if cached:
+            yield cached
+            return
+
+    retrieved = await retriever.aretrieve(query, top_k=5)
+
+    parts = []
+    async for token in rag_generate_stream_async(query, retrieved, client=client):
+        parts.append(token)
+        yield token
+
+    if use_cache and REDIS_AVAILABLE and rdb:
+        rdb.setex(cache_key, ttl, "".join(parts))
+
+
 async def batch_rag(
     queries: List[str],
     retriever: HybridRetriever,
-    max_concurrent: int = 10
+    max_concurrent: int = 10,
+    ttl: int = 3600
 ) -> List[str]:
     """
     Process multiple queries concurrently with semaphore.
+    Cache lookups and writes are batched: one MGET up front, one pipeline at the end.
 
     Args:
         queries: List of questions
         retriever: HybridRetriever instance
         max_concurrent: Max concurrent requests
+        ttl: Cache TTL in seconds
 
     Returns:
         List of answers
     """
+    use_cache = REDIS_AVAILABLE and rdb
+    cached = rdb.mget([_cache_key(q) for q in queries]) if use_cache else [None] * len(queries)
+
+    # Run RAG only for misses, once per distinct query
+    misses = list(dict.fromkeys(q for q, hit in zip(queries, cached) if not hit))
     semaphore = asyncio.Semaphore(max_concurrent)
 
     async def process_one(q):
         async with semaphore:
-            return await cached_rag(q, retriever)
+            return await cached_rag(q, retriever, use_cache=False)
+
+    tasks = [process_one(q) for q in misses]
+    generated = dict(zip(misses, await asyncio.gather(*tasks)))
+
+    if use_cache and generated:
+        pipe = rdb.pipeline(transaction=False)
+        for q, answer in generated.items():
+            pipe.setex(_cache_key(q), ttl, answer)
+        pipe.execute()
 
-    tasks = [process_one(q) for q in queries]
-    return await asyncio.gather(*tasks)
+    return [hit if hit else generated[q] for q, hit in zip(queries, cached)]
 
 
 def clear_cache():
-    """Clear all RAG cache keys."""
+    """Clear all RAG answer cache keys (query embeddings under emb:* are kept)."""
     if REDIS_AVAILABLE and rdb:
         keys = rdb.keys("rag:*")
         if keys:
@@ -3,9 +3,17 @@ Semantic Chunking Module
 Preserves context boundaries instead of arbitrary character splits.
 """
 
-from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from typing import Iterator, List, Dict, Optional, Tuple
+import os
 import re
 
+CHUNK_WORKERS = int(os.environ.get("CHUNK_WORKERS", str(os.cpu_count() or 1)))  # Processes for chunk_documents
+
+# A paragraph: text up to the next "\n\n" (group 1 yields the same pieces as text.split("\n\n"))
+_PARA_RE = re.compile(r"(.*?)(?:\n\n|\Z)", re.DOTALL)
+
 
 def semantic_chunk(
     text: str,
@@ -26,40 +34,41 @@ def semantic_chunk(
     Returns:
         List of dicts with 'content' and 'metadata'
     """
-    # Split on semantic boundaries
-    paragraphs = text.split("\n\n")
-
     chunks = []
-    current_chunk = ""
+    # Accumulate parts and join once per chunk (repeated += would copy the prefix each time)
+    current_parts = []
+    current_len = 0
 
-    for para in paragraphs:
+    # Scan semantic boundaries lazily instead of materializing the split list
+    for match in _PARA_RE.finditer(text):
+        para = match.group(1)
         # Skip empty paragraphs
         if not para.strip():
             continue
 
         # If adding this paragraph exceeds chunk_size, save current and start new
-        if len(current_chunk) + len(para) < chunk_size:
-            current_chunk += para + "\n\n"
+        if current_len + len(para) < chunk_size:
+            current_parts.append(para)
+            current_parts.append("\n\n")
+            current_len += len(para) + 2
         else:
-            if current_chunk:
-                chunks.append(current_chunk.strip())
-            current_chunk = para + "\n\n"
+            if current_parts:
+                chunks.append("".join(current_parts).strip())
+            current_parts = [para, "\n\n"]
+            current_len = len(para) + 2
 
     # Add remaining chunk
-    if current_chunk:
-        chunks.append(current_chunk.strip())
-
-    # Add overlap between chunks for context continuity
-    overlapped_chunks = []
-    for i, chunk in enumerate(chunks):
-        content = chunk
-
-        # Add overlap from previous chunk
-        if i > 0 and overlap > 0:
-            prev_overlap = chunks[i-1][-overlap:]
-            content = prev_overlap + "\n" + content
-
-        overlapped_chunks.append(content)
+    if current_parts:
+        chunks.append("".join(current_parts).strip())
+
+    # Add overlap from the previous chunk for context continuity
+    if overlap > 0 and chunks:
+        overlapped_chunks = [chunks[0]] + [
+            "\n".join((chunks[i - 1][-overlap:], chunks[i]))
+            for i in range(1, len(chunks))
+        ]
+    else:
+        overlapped_chunks = chunks
 
     # Add metadata for traceability
     chunks_with_meta = []
@@ -77,25 +86,43 @@ def semantic_chunk(
     return chunks_with_meta
 
 
-def chunk_documents(documents: List[str], **kwargs) -> List[Dict]:
+def _chunk_indexed(item: Tuple[int, str], doc_id: Optional[str], **kwargs) -> List[Dict]:
+    """semantic_chunk for one (doc_idx, text) pair; module-level so worker processes can pickle it."""
+    doc_idx, doc = item
+    return semantic_chunk(doc, doc_id=doc_id or f"doc_{doc_idx}", **kwargs)
+
+
+def chunk_documents(documents: List[str], **kwargs) -> Iterator[Dict]:
     """
-    Chunk multiple documents.
+    Chunk multiple documents, in parallel across CHUNK_WORKERS processes
+    (semantic_chunk is pure CPU work, so threads would serialize on the GIL).
+
+    Chunks are yielded as soon as their document is done, so a consumer can
+    embed or index early batches while later documents are still being chunked.
+    Use list(chunk_documents(...)) if you need them all at once.
 
     Args:
         documents: List of document texts
-        **kwargs: Arguments passed to semantic_chunk
+        **kwargs: Arguments passed to semantic_chunk (doc_id defaults to doc_<index>)
 
-    Returns:
-        List of all chunks with metadata
+    Yields:
+        Chunks with metadata, in document order
     """
-    all_chunks = []
-
-    for doc_idx, doc in enumerate(documents):
-        doc_id = kwargs.pop('doc_id', f"doc_{doc_idx}")
-        chunks = semantic_chunk(doc, doc_id=doc_id, **kwargs)
-        all_chunks.extend(chunks)
-
-    return all_chunks
+    # Read doc_id once without mutating the caller's kwargs
+    kwargs = dict(kwargs)
+    chunk_one = partial(_chunk_indexed, doc_id=kwargs.pop("doc_id", None), **kwargs)
+
+    if CHUNK_WORKERS <= 1 or len(documents) <= 1:
+        for chunks in map(chunk_one, enumerate(documents)):
+            yield from chunks
+        return
+
+    with ProcessPoolExecutor(max_workers=min(CHUNK_WORKERS, len(documents))) as executor:
+        # map preserves document order and hands back results as they complete;
+        # chunksize amortizes the inter-process round-trips
+        chunksize = max(1, len(documents) // (4 * CHUNK_WORKERS))
+        for chunks in executor.map(chunk_one, enumerate(documents), chunksize=chunksize):
+            yield from chunks
 
 
 if __name__ == "__main__":